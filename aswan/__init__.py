@@ -2,7 +2,7 @@
 """Data collection manager"""
 from .connection_session import ConnectionSession
 from .constants import ONE_DAY, ONE_HOUR, ONE_MINUTE, ONE_WEEK, ONE_YEAR, Statuses
-from .depot import AswanDepot, ParsedCollectionEvent
+from .depot import AswanDepot, DepotConfig, ParsedCollectionEvent
 from .exceptions import BrokenSessionError, ConnectionError
 from .monitor_app import app
 from .object_store import ObjectStore
@@ -17,6 +17,7 @@ from .url_handler import (
     RequestHandler,
     RequestJsonHandler,
     RequestSoupHandler,
+    RequestStreamHandler,
     WebExtHandler,
 )
 from .utils import add_url_params
@@ -27,11 +27,19 @@ from .constants import (
     Statuses,
 )
 from .depot import AswanDepot
+from .depot.event_writer import LeaseStart
 from .exceptions import BrokenSessionError, ConnectionError
+from .metadata_handling import get_lease_owner
 from .models import CollEvent, RegEvent
+from .object_store import ObjectStore
 from .resources import Caps
 from .security import DEFAULT_PROXY, ProxyBase
-from .url_handler import ANY_HANDLER_T, RequestSoupHandler, WebExtHandler
+from .url_handler import (
+    ANY_HANDLER_T,
+    RequestSoupHandler,
+    RequestStreamHandler,
+    WebExtHandler,
+)
 from .utils import add_url_params
 
 logger = get_logger()
@@ -68,14 +76,22 @@ class ConnectionSession(ActorBase):
         eager=False,
         proxy_cls: type[ProxyBase] = DEFAULT_PROXY,
         is_webext: bool = False,
+        event_queue=None,
     ):
+        """
+        :param event_queue: if given, events are put on it for a single writer,
+          instead of being integrated by the session
+        """
         self.is_browser = is_browser
         self.eager = eager
         self._proxy = proxy_cls()
+        self._event_queue = event_queue
         if depot_path is not None:
             depot = AswanDepot(depot_path.name, depot_path.parent)
-            self.current = depot.current.setup()
-            self.store = depot.object_store
+            self.current = depot.current if event_queue else depot.current.setup()
+            self.store = depot.config.get_object_store(
+                depot.object_store_path, write_behind=depot.config.write_behind
+            )
         else:
             self.current = None
             self.store = None
@@ -83,7 +99,7 @@ class ConnectionSession(ActorBase):
         self.session = (
             BrowserSession(headless, self.eager)
             if self.is_browser
-            else (WebExtSession() if is_webext else RequestSession())
+            else (WebExtSession() if is_webext else RequestSession(self.store))
         )
         self._initiated_handlers = set()
         self._broken_handlers = set()
@@ -99,6 +115,7 @@ class ConnectionSession(ActorBase):
 
         if handler_name not in self._initiated_handlers:
             self._initiate_handler(task.handler)
+        self._start_lease(task)
 
         try:
             cached_resp = task.handler.load_cache(task.url)
@@ -120,9 +137,14 @@ class ConnectionSession(ActorBase):
                 self._broken_handlers.add(handler_name)
             self._num_queries += 1
         self.proc_result(task, out, status)
+        # an idle actor can be killed any time, so its results are written here
+        if self.store is not None:
+            self.store.flush()
 
     def stop(self):
         self.session.stop()
+        if self.store is not None:
+            self.store.close()
 
     def get_parsed_response(
         self, url, handler=RequestSoupHandler(), params: Optional[dict] = None
@@ -146,14 +168,39 @@ class ConnectionSession(ActorBase):
         return handler.parse(handler.pre_parse(content))
 
     def proc_result(self, task: HandlingTask, out: Any, status: str):
+        # versions of the same page are stored as deltas, if the store is set up so
+        delta_key = (
+            f"{task.handler.name} {task.url}"
+            if task.handler.process_indefinitely
+            else None
+        )
         event = CollEvent(
             handler=task.handler.name,
             url=task.url,
             timestamp=int(time.time()),
-            output_file=self.store.dump(out) if out is not None else "",
+            output_file=(
+                self.store.dump(out, dict_key=task.handler.name, delta_key=delta_key)
+                if out is not None
+                else ""
+            ),
             status=status,
         )
-        self.current.integrate_events([event, *task.handler.pop_registered_links()])
+        events = [event, *task.handler.pop_registered_links()]
+        # with write behind, events only get integrated once their object is stored
+        if self._event_queue is not None:
+            self.store.when_written(self._event_queue.put, events)
+        else:
+            self.store.when_written(self.current.integrate_events, events)
+
+    def _start_lease(self, task: HandlingTask):
+        # the url is handed out again if this actor dies before its result
+        if self.current is None:
+            return
+        owner = get_lease_owner()
+        if self._event_queue is not None:
+            self._event_queue.put(LeaseStart(task.handler.name, task.url, owner))
+        else:
+            self.current.start_lease(task.handler.name, task.url, lease_owner=owner)
 
     def _restart(self, new_proxy=True):
         self.session.stop()
@@ -237,8 +284,9 @@ class BrowserSession:
 
 
 class RequestSession:
-    def __init__(self):
+    def __init__(self, store: Optional[ObjectStore] = None):
         self.driver: Optional[requests.Session] = None
+        self._store = store
 
     def start(self, proxy: ProxyBase):
         self.driver = requests.Session()
@@ -250,11 +298,22 @@ class RequestSession:
 
     def get_response_content(self, handler: ANY_HANDLER_T, url: str):
         handler.handle_driver(self.driver)
+        if isinstance(handler, RequestStreamHandler) and (self._store is not None):
+            return self._stream_to_store(handler, url)
         resp = self.driver.get(url)
         if resp.ok:
             return resp.content
         return resp.status_code
 
+    def _stream_to_store(self, handler: RequestStreamHandler, url: str):
+        with self.driver.get(url, stream=True) as resp:
+            if not resp.ok:
+                return resp.status_code
+            with self._store.open_write(dict_key=handler.name) as writer:
+                for chunk in resp.iter_content(handler.chunk_size):
+                    writer.write(chunk)
+        return writer.name
+
 
 class WebExtSession:
     def __init__(self) -> None:
@@ -329,11 +388,17 @@ cap_to_kwarg = {
 }
 
 
-def get_actor_items(handlers: Iterable[ANY_HANDLER_T], depot_path: Path):
+def get_actor_items(
+    handlers: Iterable[ANY_HANDLER_T], depot_path: Path, event_queue=None
+):
     # TODO this is extreme hacky
     for handler in handlers:
         caps = handler.get_caps()
-        full_kwargs = dict(proxy_cls=handler.proxy_cls, depot_path=depot_path)
+        full_kwargs = dict(
+            proxy_cls=handler.proxy_cls,
+            depot_path=depot_path,
+            event_queue=event_queue,
+        )
         for cap in caps:
             full_kwargs.update(cap_to_kwarg.get(cap, {}))
         if isinstance(handler, WebExtHandler):
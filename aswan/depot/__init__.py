@@ -1,5 +1,5 @@
 # flake8: noqa
-from .base import ParsedCollectionEvent, Status
+from .base import DepotConfig, ParsedCollectionEvent, Status
 from .remote import RemoteMixin
 
 
@@ -0,0 +1,64 @@
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Callable, Union
+
+from .block_archive import BLOCK_EXT, BlockArchive
+
+_Handle = Union[zipfile.ZipFile, BlockArchive, BinaryIO]
+
+
+class ArchivePool:
+    """
+    open event archives shared by lazily read events,
+    the least recently used one is closed above `max_open` handles
+
+    :param max_open: maximum number of open files
+    """
+
+    def __init__(self, max_open: int = 32):
+        self.max_open = max_open
+        self._handles: OrderedDict[Path, _Handle] = OrderedDict()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return {"max_open": self.max_open}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def read(self, path: Path, offset: int, length: int) -> bytes:
+        """reads a blob of an event log, or of a block compressed one"""
+        with self._lock:
+            handle = self._get(path, _open_log)
+            if isinstance(handle, BlockArchive):
+                return handle.read(offset, length)
+            handle.seek(offset)
+            return handle.read(length)
+
+    def read_entry(self, path: Path, entry: str) -> bytes:
+        """reads an entry of a zip archive"""
+        with self._lock:
+            return self._get(path, zipfile.ZipFile).read(entry)
+
+    def close(self):
+        with self._lock:
+            while self._handles:
+                self._handles.popitem()[1].close()
+
+    def _get(self, path: Path, opener: Callable[[Path], _Handle]) -> _Handle:
+        handle = self._handles.get(path)
+        if handle is not None:
+            self._handles.move_to_end(path)
+            return handle
+        handle = self._handles[path] = opener(path)
+        while len(self._handles) > self.max_open:
+            self._handles.popitem(last=False)[1].close()
+        return handle
+
+
+def _open_log(path: Path) -> Union[BlockArchive, BinaryIO]:
+    if path.suffix == f".{BLOCK_EXT}":
+        return BlockArchive(path)
+    return path.open("rb")
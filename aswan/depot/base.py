@@ -1,20 +1,22 @@
+import json
 import os
 import pickle
 import sys
 import time
 import zipfile
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import contextmanager
-from dataclasses import asdict, dataclass, field
+from dataclasses import asdict, dataclass, field, replace
 from functools import partial, wraps
 from hashlib import md5
-from heapq import heappop, heappush
-from itertools import islice
+from heapq import heappop, heappush, merge
+from itertools import count, islice, repeat, starmap
 from pathlib import Path
 from shutil import rmtree
 from subprocess import CalledProcessError, check_output
 from tempfile import TemporaryDirectory
-from typing import Iterable, Optional, Union
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional, Union
 
 import sqlalchemy as db
 import yaml
@@ -32,18 +34,58 @@ from ..metadata_handling import (
     get_next_batch,
     integrate_events,
     reset_surls,
+    start_lease,
+)
+from ..models import (
+    Base,
+    CollEvent,
+    RegEvent,
+    SourceUrl,
+    SurlCount,
+    partial_read,
+    partial_read_path,
 )
-from ..models import Base, CollEvent, RegEvent, partial_read, partial_read_path
 from ..object_store import ObjectStore
+from ..object_store.codecs import ZIP_CODEC
+from ..object_store.hashing import DEFAULT_HASH
 from ..url_handler import ANY_HANDLER_T
+from .archive_pool import ArchivePool
+from .block_archive import BLOCK_EXT, BlockArchive, write_block_archive
+from .catalog import CATALOG_COLUMNS, EventCatalog
+from .event_log import EventLog, iter_records, write_record
+from .event_writer import LeaseStart
+from .latest_index import LatestIndex
+from .run_index import filter_index, hash_url, read_index, write_index
+from .url_dedup import UrlDedup
+
+if TYPE_CHECKING:
+    import pandas as pd  # pragma: no cover
 
 DB_KIND = "sqlite"  # :///
 COMPRESS = zipfile.ZIP_DEFLATED
 STATUS_DB_ZIP = f"db.{DB_KIND}.zip"
 EVENTS_ZIP = "events.zip"
+EVENTS_LOG = "events.log"
+EVENTS_BLOCKS = f"events.{BLOCK_EXT}"
 CONTEXT_YAML = "context.yaml"
+# what scans need of a run, without parsing its whole context
+RUN_STATS_JSON = "run-stats.json"
+CONFIG_YAML = "config.yaml"
+LATEST_INDEX = "latest-index.sqlite"
+EVENT_CATALOG = "event-catalog.sqlite"
+# one directory per handler, with its own event log and index
+PARTITIONS_DIR = "handlers"
+
+DEFAULT_LEASE_SECONDS = 3600
 
 _RUN_SPLIT = "-"
+_LATEST_KEYS = ["handler", "url_hash", "timestamp", "name", "offset", "length"]
+# source url columns missing from the databases of older versions
+_ADDED_COLUMNS = {
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "lease_owner": "VARCHAR",
+    "lease_expires": "FLOAT",
+}
 
 MySession = sessionmaker()
 logger = get_logger("base depot")
@@ -97,6 +139,94 @@ class Run(_DepotObj):
     commit_hash: str = field(default_factory=_get_git_hash)
     pip_freeze: list[str] = field(default_factory=_pip_freeze)
     start_timestamp: float = field(default_factory=time.time)
+    # collection events are archived the most recent first
+    sorted_events: bool = False
+    # of the collection events, None if the run was saved without them
+    min_timestamp: Optional[int] = None
+    max_timestamp: Optional[int] = None
+    handler_counts: Optional[dict[str, int]] = None
+
+
+@dataclass
+class RunStats:
+    sorted_events: bool = False
+    min_timestamp: Optional[int] = None
+    max_timestamp: Optional[int] = None
+    handler_counts: Optional[dict[str, int]] = None
+
+    @classmethod
+    def read(cls, run_dir: Path):
+        stats_path = run_dir / RUN_STATS_JSON
+        if stats_path.exists():
+            return cls(**json.loads(stats_path.read_text()))
+        if (run_dir / CONTEXT_YAML).exists():
+            run = Run.read(run_dir)
+            return cls(**{k: getattr(run, k) for k in cls.__dataclass_fields__})
+        # unknown, as of runs written by older versions
+        return cls()
+
+    def dump(self, run_dir: Path):
+        (run_dir / RUN_STATS_JSON).write_text(json.dumps(asdict(self)))
+
+    @property
+    def newest_bound(self) -> float:
+        return float("inf") if self.max_timestamp is None else self.max_timestamp
+
+    def may_have_events(self, handler_name=None, since=None, until=None) -> bool:
+        """False if the run surely has no such collection events"""
+        if self.handler_counts is None:
+            return True
+        if (handler_name is not None) and (handler_name not in self.handler_counts):
+            return False
+        if not self.handler_counts:
+            return False
+        if (since is not None) and (self.max_timestamp < since):
+            return False
+        return (until is None) or (self.min_timestamp < until)
+
+
+@dataclass
+class DepotConfig:
+    """local settings of a depot, shared by all the processes using it"""
+
+    packed_objects: bool = False
+    object_codec: str = ZIP_CODEC
+    object_cache_size: int = 0
+    write_behind: int = 0
+    object_hash: str = DEFAULT_HASH
+    delta_chain_length: int = 0
+    binary_events: bool = False
+    # spill the urls deduplicated in get_handler_events to files here
+    dedup_spill_dir: Optional[str] = None
+    partition_runs: bool = False
+    # if set, run archives are compressed in blocks with this codec
+    run_codec: Optional[str] = None
+    # keep the event catalog up to date on every save and pull,
+    # not only when it is queried
+    event_catalog: bool = False
+    # actors send their events to one writer of the status db
+    single_writer: bool = False
+    # urls processing for longer are handed out again, None to keep them.
+    # the lease starts when an actor picks up the url, queued urls never expire
+    lease_seconds: Optional[int] = DEFAULT_LEASE_SECONDS
+
+    @classmethod
+    def read(cls, path: Path):
+        return cls(**yaml.safe_load(path.read_text())) if path.exists() else cls()
+
+    def dump(self, path: Path):
+        path.write_text(yaml.dump(asdict(self)))
+
+    def get_object_store(self, root: Path, **kwargs) -> ObjectStore:
+        return ObjectStore(
+            root,
+            packed=self.packed_objects,
+            codec=self.object_codec,
+            cache_size=self.object_cache_size,
+            hash_fun=self.object_hash,
+            delta_chain_length=self.delta_chain_length,
+            **kwargs,
+        )
 
 
 @dataclass
@@ -123,7 +253,13 @@ class StatusCache:
 
 
 class Current:
-    def __init__(self, root: Path) -> None:
+    def __init__(
+        self,
+        root: Path,
+        archive_pool: Optional[ArchivePool] = None,
+        binary_events: bool = False,
+        lease_seconds: Optional[int] = None,
+    ) -> None:
         def _p(s) -> Path:
             return root / s
 
@@ -131,19 +267,49 @@ class Current:
         self.db_path, self.parent, self.events, self.run_ctx = map(
             _p, [f"db.{DB_KIND}", "parent", "events", CONTEXT_YAML]
         )
+        self.event_log = EventLog(root / "event-log")
+        self.archive_pool = archive_pool or ArchivePool()
+        self.binary_events = binary_events
         self.db_constr = f"{DB_KIND}:///{self.db_path.as_posix()}"
         self.events.mkdir(parents=True, exist_ok=True)
         self.engine = db.create_engine(self.db_constr)
+        self.lease_seconds = lease_seconds
         self.next_batch = self._wrap(get_next_batch)
+        self.start_lease = self._wrap(partial(start_lease, lease_seconds=lease_seconds))
         self.reset_surls = self._wrap(reset_surls)
 
     def setup(self):
         self.events.mkdir(parents=True, exist_ok=True)
         self.engine = db.create_engine(self.db_constr)
-        Base.metadata.create_all(self.engine)
+        # the counts are filled from the urls of an existing db in upgrade_db
+        tables = [
+            t for t in Base.metadata.sorted_tables if t is not SurlCount.__table__
+        ]
+        Base.metadata.create_all(self.engine, tables=tables)
+        self.upgrade_db()
         return self
 
+    def upgrade_db(self):
+        """adds what is missing from a database written by an older version"""
+        table = SourceUrl.__table__
+        with self.engine.begin() as conn:
+            columns = {c["name"] for c in db.inspect(conn).get_columns(table.name)}
+            for col_name, col_def in _ADDED_COLUMNS.items():
+                if col_name not in columns:
+                    add_q = f"ADD COLUMN {col_name} {col_def}"
+                    conn.execute(db.text(f"ALTER TABLE {table.name} {add_q}"))
+            SourceUrl.ix_frontier.create(conn, checkfirst=True)
+            counts = SurlCount.__table__
+            if not db.inspect(conn).has_table(counts.name):
+                # creates the triggers that keep the counts from now on
+                counts.create(conn)
+                cols = [SourceUrl.handler, SourceUrl.current_status]
+                count_q = db.select(*cols, db.func.count()).group_by(*cols)
+                conn.execute(counts.insert().from_select(counts.c.keys(), count_q))
+
     def purge(self):
+        self.event_log.close()
+        self.archive_pool.close()
         if self.root.exists():
             rmtree(self.root)
 
@@ -155,16 +321,75 @@ class Current:
 
     def any_in_progress(self):
         with self._get_session() as session:
-            for status, _, count in get_grouped_surls(session):
+            for status, _, n_urls in get_grouped_surls(session):
                 if status == Statuses.PROCESSING:
-                    return count > 0
+                    return n_urls > 0
 
     def integrate_events(self, events: Iterable[Union[CollEvent, RegEvent]]):
-        self._wrap(integrate_events)(events, self.events)
+        self._wrap(integrate_events)(self._log_events(events))
+
+    def integrate_queued(self, items: Iterable[Union[list, LeaseStart]]):
+        """event lists and lease starts in the order they were queued,
+        committed together
+        """
+        with self._get_session() as session:
+            for item in items:
+                if isinstance(item, LeaseStart):
+                    start_lease(
+                        session,
+                        item.handler,
+                        item.url,
+                        self.lease_seconds,
+                        item.owner,
+                        commit=False,
+                    )
+                else:
+                    integrate_events(session, self._log_events(item), commit=False)
+            session.commit()
+
+    def iter_events(self) -> Iterator[Union[CollEvent, RegEvent]]:
+        """unextended events, that read their blobs when extended"""
+        # event files are written by versions before the event log
+        yield from map(partial_read_path, self.events.iterdir())
+        for path, name, blob, offset in self.event_log.iter_records():
+            _fun = partial(self.archive_pool.read, path, offset, len(blob))
+            yield partial_read(name, _fun)
+
+    def has_events(self):
+        return next(self.iter_events(), None) is not None
+
+    def archive_events(self, run_dir: Path, partitioned: bool = False) -> list[Path]:
+        """writes all the events of the run into event log files
+
+        collection events come first, the most recent first
+
+        :param partitioned: the events of every handler are written
+          to a separate directory
+        :return: the directories of the written event logs
+        """
+        self.event_log.close()
+        records = [(p.name, p.read_bytes) for p in self.events.iterdir()]
+        for log_path, name, blob, offset in self.event_log.iter_records():
+            records.append(
+                (name, partial(self.archive_pool.read, log_path, offset, len(blob)))
+            )
+        records.sort(key=lambda rec: _archive_order(rec[0]))
+        archives = defaultdict(list)
+        for name, read in records:
+            handler = partial_read(name, None).handler
+            archive_dir = run_dir / PARTITIONS_DIR / handler if partitioned else run_dir
+            archives[archive_dir].append((name, read))
+        for archive_dir, archive_records in archives.items():
+            archive_dir.mkdir(exist_ok=True, parents=True)
+            with (archive_dir / EVENTS_LOG).open("wb") as fp:
+                for name, read in archive_records:
+                    write_record(fp, name, read())
+        return [*archives.keys()]
 
     def get_run_name(self):
+        event_paths = [*self.events.iterdir(), *self.event_log.segments()]
         hash_base = self.run_ctx.read_text() + "::".join(
-            sorted(map(Path.name.fget, self.events.iterdir()))
+            sorted(map(Path.name.fget, event_paths))
         )
         _ts = Run.read(self.root).start_timestamp
         return _RUN_SPLIT.join(map(str, [_ts, _hash_str(hash_base)]))
@@ -175,6 +400,16 @@ class Current:
         yield session
         session.close()
 
+    def _log_events(self, events: Iterable[Union[CollEvent, RegEvent]]):
+        records = []
+        for event in events:
+            records.append(event.to_record(self.binary_events))
+            if len(records) >= self.event_log.sync_every:
+                self.event_log.append(records)
+                records = []
+            yield event
+        self.event_log.append(records)
+
     def _wrap(self, fun):
         @wraps(fun)
         def f(*args, **kwargs):
@@ -185,24 +420,40 @@ class Current:
 
 
 class DepotBase:
-    def __init__(self, name: str, local_root: Optional[Path] = None) -> None:
+    def __init__(
+        self,
+        name: str,
+        local_root: Optional[Path] = None,
+        config: Optional[DepotConfig] = None,
+    ) -> None:
         self.name = name
         self.root = (
             Path(local_root or os.environ.get(DEPOT_ROOT_ENV_VAR) or DEFAULT_DEPOT_ROOT)
             / name
         )
+        self._config_path = self.root / CONFIG_YAML
+        self.config = config or DepotConfig.read(self._config_path)
         self.object_store_path = self.root / "object-store"
-        self.object_store = ObjectStore(self.object_store_path)
+        self.object_store = self.config.get_object_store(self.object_store_path)
         self.statuses_path = self.root / "statuses"
         self.runs_path = self.root / "runs"
-        self.current = Current(self.root / "current-run")
+        self.archive_pool = ArchivePool()
+        self.current = Current(
+            self.root / "current-run",
+            self.archive_pool,
+            self.config.binary_events,
+            self.config.lease_seconds,
+        )
         self._cache_path = self.root / "status-cache.pkl"
+        self.latest_index = LatestIndex(self.root / LATEST_INDEX)
+        self.catalog = EventCatalog(self.root / EVENT_CATALOG)
         self._status_cache = self._load_status_cache()
         self._init_dirs = [self.runs_path, self.statuses_path, self.object_store_path]
 
     def setup(self, init=False):
         for p in self._init_dirs:
             p.mkdir(exist_ok=True, parents=True)
+        self.config.dump(self._config_path)
         if init:
             self.init_w_complete()
         return self
@@ -241,6 +492,7 @@ class DepotBase:
             self.current.parent.write_text(status.name)
             with self._status_db_zip(status.name, "r") as zfp:
                 zfp.extract(self.current.db_path.name, path=self.current.root)
+            self.current.upgrade_db()
         Run().dump(self.current.root)
 
     def integrate(self, status: Status, runs: Iterable[str]) -> Status:
@@ -249,6 +501,7 @@ class DepotBase:
             try:
                 with self._status_db_zip(status.name, "r") as zfp:
                     zfp.extract(self.current.db_path.name, path=tmp_dir)
+                tmp_curr.upgrade_db()
                 parent_name = status.name
             except FileNotFoundError:
                 logger.warn(f"integrating to an empty database {status.name}")
@@ -260,15 +513,28 @@ class DepotBase:
 
     def save_current(self) -> Status:
         # not saving a zero event run!
-        if not [*self.current.events.iterdir()]:
+        if not self.current.has_events():
             return
         run_name = self.current.get_run_name()
         run_dir = self.runs_path / run_name
         run_dir.mkdir()
-        with self._run_events_zip(run_name, "w") as zfp:
-            for ev_path in self.current.events.iterdir():
-                zfp.write(ev_path, ev_path.name)
-        Run.read(self.current.root).dump(run_dir)
+        partitioned = self.config.partition_runs
+        for archive_dir in self.current.archive_events(run_dir, partitioned):
+            log_path = archive_dir / EVENTS_LOG
+            write_index(archive_dir, log_path)
+            if self.config.run_codec is not None:
+                # the index stays valid, blocks are addressed by log offsets
+                blocks_path = archive_dir / EVENTS_BLOCKS
+                write_block_archive(log_path, blocks_path, self.config.run_codec)
+                log_path.unlink()
+        self.update_latest_index()
+        if self.config.event_catalog:
+            self.update_catalog()
+        stats = RunStats(
+            sorted_events=True, **_get_event_stats(self.current.iter_events())
+        )
+        replace(Run.read(self.current.root), **asdict(stats)).dump(run_dir)
+        stats.dump(run_dir)
         status = Status(self.current.get_parent(), [run_name])
         return self._save_status_from_current(self.current, status)
 
@@ -280,39 +546,173 @@ class DepotBase:
         from_current: bool = False,
         past_runs: Union[None, int, Iterable[str]] = None,
         post_status: Optional[str] = None,
+        workers: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
     ) -> Iterable["ParsedCollectionEvent"]:
-        urls = set()
-        handler_name = (
-            handler
-            if (isinstance(handler, str) or handler is None)
-            else handler.__name__
-        )
-
-        def _filter(ev: CollEvent):
-            return (
-                ((handler_name is None) or (ev.handler == handler_name))
-                and ((not only_successful) or (ev.status in SUCCESS_STATUSES))
-                and ((not only_latest) or (ev.extend().url not in urls))
-            )
+        """collection events, the most recent first
+
+        events of the runs are merged by their timestamps,
+        so the events of overlapping runs are ordered as well
+
+        :param workers: if given, runs are decoded and filtered on a process pool
+          with this many processes, yielding the same events in the same order
+        :param since: only events at or after this unix timestamp
+        :param until: only events before this unix timestamp.
+          runs that have no events in the range are not opened
+        """
+        handler_name = _get_handler_name(handler)
+        statuses = SUCCESS_STATUSES if only_successful else None
+        time_range = (since, until)
+        if (
+            (handler_name is not None)
+            and only_successful
+            and only_latest
+            and not (from_current or past_runs or post_status)
+            and (time_range == (None, None))
+        ):
+            yield from self._get_latest_events(handler_name)
+            return
 
         if post_status is not None:
             old_tree = self._get_full_run_tree(self.get_status(post_status))
             past_runs = self.get_all_run_ids() - old_tree
 
         if from_current:
-            event_iters = [map(partial_read_path, self.current.events.iterdir())]
-        elif isinstance(past_runs, int):
-            event_iters = islice(self._iter_runs(), past_runs)
-        elif past_runs is None:
-            event_iters = self._iter_runs()
+            ev_iter = self.current.iter_events()
+            merged = _filter_events(
+                ev_iter, handler_name, statuses, time_range=time_range
+            )
         else:
-            event_iters = map(self._get_run_events, sorted(past_runs, reverse=True))
-
-        for ev_iter in event_iters:
-            for ev in filter(_filter, get_sorted_coll_events(ev_iter)):
-                yield ParsedCollectionEvent(ev, self.object_store)
+            if isinstance(past_runs, int):
+                run_names = islice(self._iter_run_names(), past_runs)
+            elif past_runs is None:
+                run_names = self._iter_run_names()
+            else:
+                run_names = sorted(past_runs, reverse=True)
+            run_stats = [
+                (name, RunStats.read(self.runs_path / name)) for name in run_names
+            ]
+            if time_range != (None, None):
+                run_stats = [
+                    (name, stats)
+                    for name, stats in run_stats
+                    if stats.may_have_events(handler_name, *time_range)
+                ]
+            # runs are opened by their newest event, only once it can be next
+            runs = sorted(
+                [
+                    (stats.newest_bound, rank, name, stats.sorted_events)
+                    for rank, (name, stats) in enumerate(run_stats)
+                ],
+                key=lambda run: -run[0],
+            )
+            _get = partial(
+                _iter_matching_events,
+                self.runs_path,
+                handler_name,
+                statuses,
+                time_range,
+                self.archive_pool,
+            )
+            opened_runs = [run[2:] for run in runs]
+            if workers:
+                event_iters = _scan_on_processes(_get, opened_runs, workers)
+            else:
+                event_iters = starmap(_get, opened_runs)
+            merged = _merge_runs([run[:2] for run in runs], event_iters)
+
+        url_hashes = UrlDedup(spill_dir=self.config.dedup_spill_dir)
+        try:
+            # every run is sorted, only the next event of the opened ones is held
+            for ev, url_hash in merged:
                 if only_latest:
-                    urls.add(ev.url)
+                    url_hash = url_hash or hash_url(ev.extend().url)
+                    if not url_hashes.add(url_hash):
+                        continue
+                yield ParsedCollectionEvent(ev, self.object_store)
+        finally:
+            url_hashes.close()
+
+    def update_latest_index(self):
+        """adds the runs missing from the latest event index,
+        and drops the removed ones
+        """
+        archives = self._get_archive_names()
+        removed = self.latest_index.removed_runs(archives)
+        missing = self.latest_index.missing_runs(archives)
+        lost = self.latest_index.drop_runs(removed)
+        if lost:
+            # the new latest events of these urls can be in any other run
+            for archive in set(archives) - missing:
+                rows = _iter_latest_candidates(self.runs_path / archive)
+                self.latest_index.restore_events(
+                    archive, self._get_run_ts(archive), rows, lost
+                )
+        for archive in missing:
+            rows = _iter_latest_candidates(self.runs_path / archive)
+            self.latest_index.add_run(archive, self._get_run_ts(archive), rows)
+
+    def update_catalog(self):
+        """adds the runs missing from the event catalog"""
+        for archive in self.catalog.missing_archives(self._get_archive_names()):
+            rows = _iter_catalog_rows(self.runs_path / archive)
+            self.catalog.add_archive(archive, archive.split("/")[0], rows)
+
+    def query(self, sql: str, **params) -> list[dict]:
+        """runs a query on the event catalog, after adding the missing runs
+
+        e.g. `SELECT handler, date(timestamp, 'unixepoch') AS day, count(*) AS n
+        FROM events GROUP BY handler, day`
+        """
+        self.update_catalog()
+        return self.catalog.query(sql, **params)
+
+    def query_frame(self, sql: str, **params) -> "pd.DataFrame":
+        import pandas as pd
+
+        return pd.DataFrame(self.query(sql, **params))
+
+    def train_dictionary(
+        self, handler: Union[str, ANY_HANDLER_T], sample_size: int = 1000, **kwargs
+    ) -> str:
+        """trains a compression dictionary on the latest objects of the handler
+
+        kwargs are passed to :meth:`ObjectStore.train_dictionary`
+        """
+        pcevs = islice(self.get_handler_events(handler), sample_size)
+        names = set(filter(None, [pcev.cev.extend().output_file for pcev in pcevs]))
+        handler_name = _get_handler_name(handler)
+        return self.object_store.train_dictionary(handler_name, names, **kwargs)
+
+    def gc_objects(
+        self, workers: Optional[int] = None, archive: Optional[Path] = None
+    ) -> int:
+        """removes the objects not referenced by any run or the current run
+
+        runs are scanned in parallel, streaming their events
+
+        :param archive: root of an object store, where unreferenced objects are moved
+        :return: the number of bytes reclaimed
+        """
+        live = set()
+        with ProcessPoolExecutor(workers) as executor:
+            run_ids = self.get_all_run_ids()
+            for run_refs in executor.map(
+                _get_run_refs, repeat(self.runs_path), run_ids
+            ):
+                live |= run_refs
+        for ev in self.current.iter_events():
+            if isinstance(ev, CollEvent):
+                live.add(ev.extend().output_file)
+        archive_store = None
+        if archive is not None:
+            archive_store = self.config.get_object_store(archive)
+        reclaimed = self.object_store.sweep(live, archive_store)
+        if archive_store is not None:
+            archive_store.close()
+        logger.info("collected garbage", live=len(live), reclaimed=reclaimed)
+        return reclaimed
 
     def cleanup_statuses(self):
         errs = {}
@@ -363,24 +763,47 @@ class DepotBase:
             parent = parent_status.parent
         return out
 
-    def _iter_runs(self) -> Iterable[Iterable[CollEvent]]:
+    def _iter_run_names(self) -> Iterable[str]:
         runs = []
         for run_path in self.runs_path.glob("*"):
             heappush(runs, (-_start_timestamp_from_run_path(run_path), run_path.name))
         while runs:
             _, run_name = heappop(runs)
-            yield self._get_run_events(run_name)
+            yield run_name
+
+    def _get_archive_names(self) -> list[str]:
+        # the handler partitions of runs are separate archives,
+        # as they might be pulled separately
+        if not self.runs_path.exists():
+            return []
+        return [
+            archive_dir.relative_to(self.runs_path).as_posix()
+            for run_name in self.get_all_run_ids()
+            for archive_dir in _archive_dirs(self.runs_path / run_name)
+        ]
+
+    def _get_run_ts(self, archive: str) -> float:
+        run_name = archive.split("/")[0]
+        return _start_timestamp_from_run_path(self.runs_path / run_name)
+
+    def _get_latest_events(self, handler_name: str):
+        self.update_latest_index()
+        for run_name, name, offset, length in self.latest_index.lookup(handler_name):
+            archive_dir = self.runs_path / run_name
+            if offset < 0:
+                path = archive_dir / EVENTS_ZIP
+            else:
+                path = _event_log_path(archive_dir)
+            _fun = _pooled_reader(self.archive_pool, path, name, offset, length)
+            ev = partial_read(name, _fun).extend()
+            yield ParsedCollectionEvent(ev, self.object_store)
 
     def _get_run_events(self, run_name, extend=True):
-        with self._run_events_zip(run_name, "r") as zfp:
-            for event in zfp.filelist:
-                if extend:
-                    yield partial_read(
-                        event.filename, partial(zfp.read, event)
-                    ).extend()
-                else:
-                    _fun = partial(_read_event_blob, self.runs_path, run_name, event)
-                    yield partial_read(event.filename, _fun)
+        if extend:
+            for ev in _iter_run_events(self.runs_path, run_name):
+                yield ev.extend()
+        else:
+            yield from _iter_run_events(self.runs_path, run_name, self.archive_pool)
 
     def _save_status_from_current(self, current: Current, status: Status):
         status_dir = self.statuses_path / status.name
@@ -394,9 +817,6 @@ class DepotBase:
     def _status_db_zip(self, status_name, mode):
         return _zipfile(self.statuses_path, status_name, STATUS_DB_ZIP, mode)
 
-    def _run_events_zip(self, run_name, mode):
-        return _zipfile(self.runs_path, run_name, EVENTS_ZIP, mode)
-
     def _load_status_cache(self) -> StatusCache:
         return StatusCache.read(self._cache_path)
 
@@ -424,7 +844,16 @@ class ParsedCollectionEvent:
         return f"{self.status}: {self.handler_name} - {self.url} ({self._time})"
 
 
-def get_sorted_coll_events(event_iterator: Iterable) -> Iterable[CollEvent]:
+def get_sorted_coll_events(
+    event_iterator: Iterable, presorted: bool = False
+) -> Iterable[CollEvent]:
+    """collection events, the most recent first
+
+    :param presorted: the events are already ordered, and are streamed
+    """
+    if presorted:
+        yield from filter(lambda ev: isinstance(ev, CollEvent), event_iterator)
+        return
     coll_evs = []
     for ev in event_iterator:
         if isinstance(ev, CollEvent):
@@ -434,9 +863,257 @@ def get_sorted_coll_events(event_iterator: Iterable) -> Iterable[CollEvent]:
         yield heappop(coll_evs)
 
 
-def _read_event_blob(root, dirname, event_name):
-    with _zipfile(root, dirname, EVENTS_ZIP, "r") as zfp:
-        return zfp.read(event_name)
+def _filter_events(
+    events: Iterable,
+    handler_name: Optional[str],
+    statuses,
+    presorted=False,
+    time_range=(None, None),
+) -> Iterable[tuple[CollEvent, None]]:
+    since, until = time_range
+    for ev in get_sorted_coll_events(events, presorted):
+        if ((handler_name is None) or (ev.handler == handler_name)) and (
+            (statuses is None) or (ev.status in statuses)
+        ):
+            if (since is not None) and (ev.timestamp < since):
+                if presorted:
+                    return
+                continue
+            if (until is None) or (ev.timestamp < until):
+                yield ev, None
+
+
+def _get_handler_name(handler: Optional[Union[str, ANY_HANDLER_T]]):
+    if isinstance(handler, str) or handler is None:
+        return handler
+    return handler.__name__
+
+
+def _archive_dirs(run_dir: Path, handler_name: Optional[str] = None) -> list[Path]:
+    """directories of the event archives of a run
+
+    one per handler if the run is partitioned,
+    only the one of the handler if it is given
+    """
+    parts_dir = run_dir / PARTITIONS_DIR
+    if not parts_dir.exists():
+        return [run_dir]
+    if handler_name is not None:
+        return [d for d in [parts_dir / handler_name] if d.exists()]
+    return sorted(parts_dir.iterdir())
+
+
+def _event_log_path(archive_dir: Path) -> Path:
+    blocks_path = archive_dir / EVENTS_BLOCKS
+    return blocks_path if blocks_path.exists() else archive_dir / EVENTS_LOG
+
+
+def _iter_run_records(runs_path: Path, run_name: str):
+    """name, reader, archive path, offset and length of the event records
+
+    offset and length are -1 for zip archives
+    """
+    for archive_dir in _archive_dirs(runs_path / run_name):
+        yield from _iter_archive_records(archive_dir)
+
+
+def _iter_archive_records(archive_dir: Path):
+    log_path = _event_log_path(archive_dir)
+    if log_path.name == EVENTS_BLOCKS:
+        blocks = BlockArchive(log_path)
+        try:
+            for name, blob, offset in blocks.iter_records():
+                yield name, partial(bytes, blob), log_path, offset, len(blob)
+        finally:
+            blocks.close()
+        return
+    if log_path.exists():
+        for name, blob, offset in iter_records(log_path):
+            yield name, partial(bytes, blob), log_path, offset, len(blob)
+        return
+    # runs saved before the event log
+    zip_path = archive_dir / EVENTS_ZIP
+    with _zipfile(archive_dir.parent, archive_dir.name, EVENTS_ZIP, "r") as zfp:
+        for info in zfp.filelist:
+            yield info.filename, partial(zfp.read, info), zip_path, -1, -1
+
+
+def _iter_run_events(
+    runs_path: Path, run_name: str, pool: Optional[ArchivePool] = None
+):
+    # with a pool, events are lazy and only read their blob when extended
+    for name, _fun, path, offset, length in _iter_run_records(runs_path, run_name):
+        if pool is not None:
+            _fun = _pooled_reader(pool, path, name, offset, length)
+        yield partial_read(name, _fun)
+
+
+def _pooled_reader(pool: ArchivePool, path: Path, name: str, offset, length):
+    if offset < 0:
+        return partial(pool.read_entry, path, name)
+    return partial(pool.read, path, offset, length)
+
+
+def _iter_matching_events(
+    runs_path: Path,
+    handler_name: Optional[str],
+    statuses,
+    time_range: tuple,
+    pool: ArchivePool,
+    run_name: str,
+    presorted: bool,
+) -> Iterable[tuple[CollEvent, Optional[int]]]:
+    """the most recent first, with their url hash if the run is indexed
+
+    of a partitioned run, only the partition of the handler is read
+    """
+    run_dir = runs_path / run_name
+    archive_iters = [
+        _iter_matching_archive_events(
+            d, handler_name, statuses, time_range, pool, presorted
+        )
+        for d in _archive_dirs(run_dir, handler_name)
+    ]
+    yield from merge(*archive_iters, key=_newest_first)
+
+
+def _iter_matching_archive_events(
+    archive_dir: Path,
+    handler_name: Optional[str],
+    statuses,
+    time_range: tuple,
+    pool: ArchivePool,
+    presorted: bool,
+):
+    index = read_index(archive_dir)
+    if index is None:
+        records = _iter_archive_records(archive_dir)
+        events = (partial_read(rec[0], rec[1]).extend() for rec in records)
+        yield from _filter_events(events, handler_name, statuses, presorted, time_range)
+        return
+    # only the blobs of matching events are read
+    log_path = _event_log_path(archive_dir)
+    for i in filter_index(index, handler_name, statuses, *time_range):
+        _fun = partial(pool.read, log_path, index["offset"][i], index["length"][i])
+        ev = partial_read(str(index["name"][i]), _fun)
+        yield ev.extend(), int(index["url_hash"][i])
+
+
+def _iter_latest_candidates(archive_dir: Path) -> Iterable[dict]:
+    # successful collection events with their locations
+    index = read_index(archive_dir)
+    if index is not None:
+        rows = filter_index(index, None, SUCCESS_STATUSES)
+        cols = {k: index[k][rows].tolist() for k in _LATEST_KEYS}
+        for values in zip(*cols.values()):
+            yield dict(zip(cols.keys(), values))
+        return
+    for name, _fun, _, offset, length in _iter_archive_records(archive_dir):
+        ev = partial_read(name, _fun)
+        if isinstance(ev, CollEvent) and (ev.status in SUCCESS_STATUSES):
+            ev.extend()
+            yield {
+                "handler": ev.handler,
+                "url_hash": hash_url(ev.url),
+                "timestamp": ev.timestamp,
+                "name": name,
+                "offset": offset,
+                "length": length,
+            }
+
+
+def _iter_catalog_rows(archive_dir: Path) -> Iterable[dict]:
+    for name, _fun, *_ in _iter_archive_records(archive_dir):
+        ev = partial_read(name, _fun)
+        if isinstance(ev, CollEvent):
+            ev.extend()
+            yield {k: getattr(ev, k) for k in CATALOG_COLUMNS}
+
+
+def _scan_run(get_events: Callable, run: tuple) -> list[tuple[CollEvent, int]]:
+    # url hashes are computed in the worker as well
+    return [(ev, url_hash or hash_url(ev.url)) for ev, url_hash in get_events(*run)]
+
+
+def _scan_on_processes(get_events: Callable, runs: Iterable[tuple], workers: int):
+    # results are yielded in order, with a bounded number of runs read ahead
+    with ProcessPoolExecutor(workers) as executor:
+        futures = deque()
+        for run in runs:
+            futures.append(executor.submit(_scan_run, get_events, run))
+            if len(futures) >= workers * 2:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def _get_run_refs(runs_path: Path, run_name: str) -> set[str]:
+    out = set()
+    for archive_dir in _archive_dirs(runs_path / run_name):
+        index = read_index(archive_dir)
+        if index is not None:
+            out.update(index["output_file"].tolist())
+            continue
+        for name, _fun, *_ in _iter_archive_records(archive_dir):
+            ev = partial_read(name, _fun)
+            if isinstance(ev, CollEvent):
+                out.add(ev.extend().output_file)
+    return out
+
+
+def _archive_order(record_name: str):
+    ev = partial_read(record_name, None)
+    return (0, -ev.timestamp) if isinstance(ev, CollEvent) else (1, 0)
+
+
+def _newest_first(item: tuple[CollEvent, Optional[int]]):
+    return -item[0].timestamp
+
+
+def _merge_runs(
+    runs: list[tuple[float, int]], event_iters: Iterable[Iterable]
+) -> Iterator[tuple[CollEvent, Optional[int]]]:
+    """merges the events of runs, the most recent first
+
+    :param runs: max timestamp and start rank of each run,
+      by decreasing max timestamp. ties are ordered by rank
+    :param event_iters: events of the runs, in the same order,
+      the next one is only taken when its run can hold the next event
+    """
+    heap = []
+    event_iters = iter(event_iters)
+    tiebreak = count()
+
+    def _push(it, rank):
+        for item in it:
+            heappush(heap, (-item[0].timestamp, rank, next(tiebreak), item, it))
+            return
+
+    pending = iter(runs)
+    run = next(pending, None)
+    while True:
+        while (run is not None) and ((not heap) or (-heap[0][0] <= run[0])):
+            _push(iter(next(event_iters)), run[1])
+            run = next(pending, None)
+        if not heap:
+            return
+        *_, rank, _, item, it = heappop(heap)
+        yield item
+        _push(it, rank)
+
+
+def _get_event_stats(events: Iterable) -> dict:
+    timestamps = []
+    handler_counts = defaultdict(int)
+    for ev in events:
+        if isinstance(ev, CollEvent):
+            timestamps.append(ev.timestamp)
+            handler_counts[ev.handler] += 1
+    return {
+        "min_timestamp": min(timestamps, default=None),
+        "max_timestamp": max(timestamps, default=None),
+        "handler_counts": dict(handler_counts),
+    }
 
 
 def _start_timestamp_from_run_path(p: Path):
@@ -0,0 +1,90 @@
+import io
+import struct
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterator
+
+from ..object_store.codecs import CODECS, encode_header, read_header
+from .event_log import iter_records, iter_stream_records
+
+BLOCK_EXT = "blocks"
+DEFAULT_BLOCK_SIZE = 2**16
+
+# uncompressed start, offset and compressed length of a block
+_BLOCK = struct.Struct("<QQI")
+# number of blocks - preceded by the block index
+_FOOTER = struct.Struct("<I")
+_MAGIC = b"ASWNBLK1"
+
+
+def write_block_archive(
+    log_path: Path,
+    out_path: Path,
+    codec: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+):
+    """compresses an event log into blocks of whole records
+
+    a record is addressed by the same offset as in the event log
+    """
+    comp = CODECS[codec]
+    blocks = []
+    with log_path.open("rb") as src, out_path.open("wb") as fp:
+        fp.write(encode_header(comp))
+        block_start = 0
+
+        def _cut(end):
+            src.seek(block_start)
+            payload = comp.compress(src.read(end - block_start))
+            blocks.append(_BLOCK.pack(block_start, fp.tell(), len(payload)))
+            fp.write(payload)
+
+        end = 0
+        for _, blob, offset in iter_records(log_path):
+            end = offset + len(blob)
+            if end - block_start >= block_size:
+                _cut(end)
+                block_start = end
+        if end > block_start:
+            _cut(end)
+        fp.write(b"".join(blocks) + _FOOTER.pack(len(blocks)) + _MAGIC)
+
+
+class BlockArchive:
+    """reader of a block compressed event log
+
+    the last read block is kept decompressed
+    """
+
+    def __init__(self, path: Path):
+        self._fp = path.open("rb")
+        self._codec, _ = read_header(self._fp)
+        tail = _FOOTER.size + len(_MAGIC)
+        self._fp.seek(-tail, 2)
+        (n_blocks,) = _FOOTER.unpack(self._fp.read(_FOOTER.size))
+        self._fp.seek(-tail - n_blocks * _BLOCK.size, 2)
+        index_buf = self._fp.read(n_blocks * _BLOCK.size)
+        self._blocks = [b for b in _BLOCK.iter_unpack(index_buf)]
+        self._starts = [b[0] for b in self._blocks]
+        self._cached = (-1, b"")
+
+    def read(self, offset: int, length: int) -> bytes:
+        i = bisect_right(self._starts, offset) - 1
+        pos = offset - self._starts[i]
+        return self._block(i)[pos : pos + length]
+
+    def iter_records(self) -> Iterator[tuple[str, bytes, int]]:
+        """name, blob and offset of the blob of each record"""
+        for i, start in enumerate(self._starts):
+            for name, blob, offset in iter_stream_records(io.BytesIO(self._block(i))):
+                yield name, blob, start + offset
+
+    def close(self):
+        self._fp.close()
+
+    def _block(self, i: int) -> bytes:
+        if self._cached[0] != i:
+            _, offset, length = self._blocks[i]
+            self._fp.seek(offset)
+            self._cached = (i, self._codec.decompress(self._fp.read(length)))
+        return self._cached[1]
@@ -0,0 +1,66 @@
+from typing import Iterable
+
+import sqlalchemy as db
+from sqlalchemy.dialects.sqlite import insert
+
+from .sqlite_file import SqliteFile
+
+_INSERT_BATCH = 10_000
+
+_meta = db.MetaData()
+
+catalog_events = db.Table(
+    "events",
+    _meta,
+    db.Column("run", db.String, index=True),
+    db.Column("handler", db.String),
+    db.Column("status", db.String),
+    db.Column("timestamp", db.Integer),
+    db.Column("url", db.String, index=True),
+    db.Column("output_file", db.String),
+    db.Index("ix_events_handler_timestamp", "handler", "timestamp"),
+)
+
+cataloged_archives = db.Table(
+    "cataloged_archives", _meta, db.Column("archive", db.String, primary_key=True)
+)
+
+CATALOG_COLUMNS = ["handler", "status", "timestamp", "url", "output_file"]
+
+
+class EventCatalog(SqliteFile):
+    """
+    every collection event of the saved runs in one sqlite table, `events`,
+    with run, handler, status, timestamp, url and output_file columns
+
+    archives are added incrementally, a partitioned run one handler at a time
+    """
+
+    _meta = _meta
+
+    def missing_archives(self, archives: Iterable[str]) -> set[str]:
+        with self._connect() as conn:
+            query = db.select(cataloged_archives.c.archive)
+            done = set(conn.execute(query).scalars())
+        return set(archives) - done
+
+    def add_archive(self, archive: str, run_name: str, rows: Iterable[dict]):
+        """rows need the CATALOG_COLUMNS"""
+        claim = insert(cataloged_archives).on_conflict_do_nothing()
+        with self._connect() as conn:
+            # another process may be adding the same archive
+            if conn.execute(claim, [{"archive": archive}]).rowcount:
+                batch = []
+                for row in rows:
+                    batch.append(row | {"run": run_name})
+                    if len(batch) >= _INSERT_BATCH:
+                        conn.execute(catalog_events.insert(), batch)
+                        batch = []
+                if batch:
+                    conn.execute(catalog_events.insert(), batch)
+            conn.commit()
+
+    def query(self, sql: str, **params) -> list[dict]:
+        with self._connect() as conn:
+            result = conn.execute(db.text(sql), params)
+            return [dict(row) for row in result.mappings()]
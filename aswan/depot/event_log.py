@@ -0,0 +1,106 @@
+import os
+import struct
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional
+from uuid import uuid4
+
+LOG_EXT = "log"
+DEFAULT_SEGMENT_SIZE = 2**26
+DEFAULT_SYNC_EVERY = 1000
+
+# blob length, name length - followed by the utf-8 name and the blob
+_REC_HEAD = struct.Struct("<IH")
+
+
+class EventLog:
+    """
+    append-only log of event records, in segments of at most `segment_size` bytes
+
+    every writing process appends to its own segment.
+    records are flushed right away, and fsynced after every `sync_every` records
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        sync_every: int = DEFAULT_SYNC_EVERY,
+    ):
+        self.root = root
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self._fp: Optional[BinaryIO] = None
+        self._pid: Optional[int] = None
+        self._unsynced = 0
+
+    def __getstate__(self):
+        return self.__dict__ | {"_fp": None, "_pid": None, "_unsynced": 0}
+
+    def append(self, records: Iterable[tuple[str, bytes]]):
+        fp = self._get_fp()
+        for name, blob in records:
+            write_record(fp, name, blob)
+            self._unsynced += 1
+        fp.flush()
+        if self._unsynced >= self.sync_every:
+            self._sync()
+
+    def segments(self) -> list[Path]:
+        if not self.root.exists():
+            return []
+        return sorted(self.root.glob(f"*.{LOG_EXT}"))
+
+    def iter_records(self) -> Iterator[tuple[Path, str, bytes, int]]:
+        """path, name, blob and offset of the blob of each record"""
+        for path in self.segments():
+            for name, blob, offset in iter_records(path):
+                yield path, name, blob, offset
+
+    def close(self):
+        if self._fp is not None:
+            if self._pid == os.getpid():
+                self._sync()
+                self._fp.close()
+            self._fp = None
+
+    def _get_fp(self) -> BinaryIO:
+        if (self._fp is not None) and (self._pid != os.getpid()):
+            # forked, the segment belongs to the parent
+            self._fp = None
+        elif (self._fp is not None) and (self._fp.tell() > self.segment_size):
+            self.close()
+        if self._fp is None:
+            self.root.mkdir(exist_ok=True, parents=True)
+            self._fp = (self.root / f"{uuid4().hex}.{LOG_EXT}").open("ab")
+            self._pid = os.getpid()
+        return self._fp
+
+    def _sync(self):
+        os.fsync(self._fp.fileno())
+        self._unsynced = 0
+
+
+def write_record(fp: BinaryIO, name: str, blob: bytes):
+    name_buf = name.encode("utf-8")
+    fp.write(_REC_HEAD.pack(len(blob), len(name_buf)) + name_buf + blob)
+
+
+def iter_records(path: Path) -> Iterator[tuple[str, bytes, int]]:
+    """name, blob and offset of the blob of each complete record"""
+    with path.open("rb") as fp:
+        yield from iter_stream_records(fp)
+
+
+def iter_stream_records(fp: BinaryIO) -> Iterator[tuple[str, bytes, int]]:
+    while True:
+        head = fp.read(_REC_HEAD.size)
+        if len(head) < _REC_HEAD.size:
+            return
+        blob_len, name_len = _REC_HEAD.unpack(head)
+        name_buf = fp.read(name_len)
+        offset = fp.tell()
+        blob = fp.read(blob_len)
+        if len(blob) < blob_len:
+            # partially written record
+            return
+        yield name_buf.decode("utf-8"), blob, offset
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from multiprocessing import Manager
+from queue import Empty
+from threading import Thread
+from typing import TYPE_CHECKING, Optional
+
+from structlog import get_logger
+
+if TYPE_CHECKING:
+    from .base import Current  # pragma: no cover
+
+DEFAULT_MAX_BATCH = 1000
+
+logger = get_logger("event writer")
+
+
+@dataclass
+class LeaseStart:
+    handler: str
+    url: str
+    owner: str
+
+
+class EventWriter:
+    """
+    the only writer of the events of the current run, in a thread
+
+    actors in any process put lists of events, or a LeaseStart
+    when they pick up a url, on `queue`.
+    the writer applies everything queued meanwhile in order, in one transaction
+
+    :param max_batch: maximum number of events integrated at once
+    """
+
+    def __init__(self, current: "Current", max_batch: int = DEFAULT_MAX_BATCH):
+        self.current = current
+        self.max_batch = max_batch
+        self._manager = Manager()
+        self.queue = self._manager.Queue()
+        self._thread: Optional[Thread] = None
+        self._error: Optional[Exception] = None
+
+    def start(self):
+        self._thread = Thread(target=self._drain, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """integrates the events still queued, and stops the writer"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._manager.shutdown()
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def _drain(self):
+        done = False
+        while not done:
+            items, n_events = [], 0
+            item = self.queue.get()
+            while True:
+                if item is None:
+                    done = True
+                    break
+                items.append(item)
+                if not isinstance(item, LeaseStart):
+                    n_events += len(item)
+                if n_events >= self.max_batch:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+            if not items:
+                continue
+            try:
+                self.current.integrate_queued(items)
+            except Exception as e:
+                logger.error("could not integrate events", e=str(e), n=n_events)
+                self._error = e
@@ -0,0 +1,133 @@
+from typing import Iterable
+
+import sqlalchemy as db
+from sqlalchemy.dialects.sqlite import insert
+
+from .sqlite_file import SqliteFile
+
+_meta = db.MetaData()
+
+latest_events = db.Table(
+    "latest_events",
+    _meta,
+    db.Column("handler", db.String, primary_key=True),
+    db.Column("url_hash", db.Integer, primary_key=True),
+    db.Column("run", db.String),
+    db.Column("run_ts", db.Float),
+    db.Column("timestamp", db.Integer),
+    # the name of the event record, and its location in the event log of the run
+    # offset is -1 for zip archives
+    db.Column("name", db.String),
+    db.Column("offset", db.Integer),
+    db.Column("length", db.Integer),
+)
+
+indexed_runs = db.Table(
+    "indexed_runs", _meta, db.Column("run", db.String, primary_key=True)
+)
+
+_LOCATION_COLS = ["run", "name", "offset", "length"]
+
+
+class LatestIndex(SqliteFile):
+    """
+    the latest successful collection event for every handler and url,
+    updated incrementally with every run that is saved or pulled
+
+    later events win, and of events at the same time, the ones of later runs
+    """
+
+    _meta = _meta
+
+    def missing_runs(self, run_names: Iterable[str]) -> set[str]:
+        with self._connect() as conn:
+            done = set(conn.execute(db.select(indexed_runs.c.run)).scalars())
+        return set(run_names) - done
+
+    def removed_runs(self, run_names: Iterable[str]) -> set[str]:
+        """indexed runs that are not among the run names any more"""
+        with self._connect() as conn:
+            done = set(conn.execute(db.select(indexed_runs.c.run)).scalars())
+        return done - set(run_names)
+
+    def drop_runs(self, run_names: Iterable[str]) -> set[tuple[str, int]]:
+        """removes the events of the runs
+
+        returns the handlers and url hashes that lost their latest event
+        """
+        runs = list(run_names)
+        if not runs:
+            return set()
+        of_runs = latest_events.c.run.in_(runs)
+        key_cols = [latest_events.c.handler, latest_events.c.url_hash]
+        with self._connect() as conn:
+            lost = set(map(tuple, conn.execute(db.select(*key_cols).where(of_runs))))
+            conn.execute(latest_events.delete().where(of_runs))
+            conn.execute(indexed_runs.delete().where(indexed_runs.c.run.in_(runs)))
+            conn.commit()
+        return lost
+
+    def add_run(self, run_name: str, run_ts: float, rows: Iterable[dict]):
+        """rows need handler, url_hash, timestamp, name, offset and length
+
+        of processes adding the same run at once, only the first one does
+        """
+        records = _to_records(run_name, run_ts, rows)
+        claim = insert(indexed_runs).on_conflict_do_nothing()
+        with self._connect() as conn:
+            if conn.execute(claim, [{"run": run_name}]).rowcount:
+                if records:
+                    conn.execute(_upsert(), records)
+            conn.commit()
+
+    def restore_events(
+        self,
+        run_name: str,
+        run_ts: float,
+        rows: Iterable[dict],
+        keys: set[tuple[str, int]],
+    ):
+        """adds the rows of an indexed run again, only for the lost keys"""
+        lost_rows = (
+            row for row in rows if (row["handler"], _signed(row["url_hash"])) in keys
+        )
+        records = _to_records(run_name, run_ts, lost_rows)
+        if not records:
+            return
+        with self._connect() as conn:
+            conn.execute(_upsert(), records)
+            conn.commit()
+
+    def lookup(self, handler: str) -> list[tuple[str, str, int, int]]:
+        """run, name, offset and length of the latest events, the most recent first"""
+        cols = [latest_events.c[k] for k in _LOCATION_COLS]
+        query = (
+            db.select(*cols)
+            .where(latest_events.c.handler == handler)
+            .order_by(latest_events.c.timestamp.desc(), latest_events.c.run_ts.desc())
+        )
+        with self._connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+
+def _upsert():
+    stmt = insert(latest_events)
+    new, old = stmt.excluded, latest_events.c
+    return stmt.on_conflict_do_update(
+        index_elements=[old.handler, old.url_hash],
+        set_={k: new[k] for k in ["run", "run_ts", "timestamp", *_LOCATION_COLS[1:]]},
+        where=db.tuple_(new.timestamp, new.run_ts)
+        > db.tuple_(old.timestamp, old.run_ts),
+    )
+
+
+def _to_records(run_name: str, run_ts: float, rows: Iterable[dict]) -> list[dict]:
+    return [
+        row | {"run": run_name, "run_ts": run_ts, "url_hash": _signed(row["url_hash"])}
+        for row in rows
+    ]
+
+
+def _signed(url_hash: int) -> int:
+    # sqlite integers are signed 64 bit
+    return url_hash - (1 << 64) if url_hash >= (1 << 63) else url_hash
@@ -1,29 +1,68 @@
 import os
 from functools import partial
+from itertools import chain
 from pathlib import Path
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Iterable, Optional, Union
 
 from structlog import get_logger
 
 from ..constants import DEFAULT_REMOTE_ENV_VAR, HEX_ENV, PW_ENV
-from .base import CONTEXT_YAML, EVENTS_ZIP, STATUS_DB_ZIP, DepotBase, StatusCache
+from ..object_store.base import NON_OBJECT_DIRS
+from ..object_store.packs import INDEX_EXT, PACK_DIR
+from ..object_store.streams import TMP_DIR
+from ..url_handler import ANY_HANDLER_T
+from .base import (
+    CONTEXT_YAML,
+    EVENTS_BLOCKS,
+    EVENTS_LOG,
+    EVENTS_ZIP,
+    PARTITIONS_DIR,
+    RUN_STATS_JSON,
+    STATUS_DB_ZIP,
+    DepotBase,
+    StatusCache,
+    _get_handler_name,
+)
+from .run_index import INDEX_FILES
 
 if TYPE_CHECKING:  # pragma: no cover
     from fabric import Connection
 
 logger = get_logger("remote-depot")
 
+# marks runs of which only some handler partitions are pulled
+PARTIAL_PULL = "partial-pull"
+# relative paths with their sizes
+_FIND_SIZES = '-mindepth 1 -printf "%P %s\\n"'
+_ARCHIVE_FILES = {EVENTS_LOG, EVENTS_BLOCKS, *INDEX_FILES}
+
 
 class RemoteMixin(DepotBase):
     def push(self, remote: Optional[str] = None):
         return self._conn_map(remote, self._push)
 
     def pull(
-        self, remote: Optional[str] = None, complete=False, post_status=None
+        self,
+        remote: Optional[str] = None,
+        complete=False,
+        post_status=None,
+        handlers: Optional[Iterable[Union[str, ANY_HANDLER_T]]] = None,
     ) -> set[str]:
-        """returns the run ids that have been pulled"""
+        """returns the run ids that have been pulled
+
+        :param handlers: if given, only the partitions of these handlers
+          are pulled from partitioned runs, with only their objects.
+          packed objects are not selected: every pack segment that is new
+          or grew on the remote is pulled whole, with the objects of all handlers
+        """
         return self._conn_map(
-            remote, self._pull, complete=complete, post_status=post_status
+            remote,
+            self._pull,
+            complete=complete,
+            post_status=post_status,
+            handlers=(
+                None if handlers is None else set(map(_get_handler_name, handlers))
+            ),
         )
 
     def _conn_map(self, remote, fun, **kwargs):
@@ -34,9 +73,14 @@ class RemoteMixin(DepotBase):
 
     def _push(self, conn: "Connection"):
         # TODO: add some validation so that the depot is not corrupted
-        present = set([fp[2:] for fp in conn.run("find .", hide=True).stdout.split()])
+        # the segment written by this process is pushed up to its last record
+        self.object_store.close()
+        present = _parse_sizes(conn.run(f"find . {_FIND_SIZES}", hide=True).stdout)
         for dir_path in self._init_dirs:
             for subdir in dir_path.iterdir():
+                if subdir == self.object_store_path / TMP_DIR:
+                    # unfinished streams
+                    continue
                 self._push_subdir(subdir, conn, present)
         self._merge_status_cache(conn)
         self._status_cache.dump(self._cache_path)
@@ -48,18 +92,30 @@ class RemoteMixin(DepotBase):
         except Exception as e:
             logger.warning("couldn't push status cache", e=str(e), e_type=type(e))
 
-    def _push_subdir(self, subdir: Path, conn: "Connection", present: set):
+    def _push_subdir(self, subdir: Path, conn: "Connection", present: dict):
         rel_path = subdir.relative_to(self.root)
         if rel_path.as_posix() not in present:
             conn.run(f"mkdir -p {rel_path}")
-        for elem in subdir.iterdir():
+        for elem in sorted(subdir.iterdir(), key=_transfer_order):
             rel_elem = rel_path / elem.name
-            if rel_elem.as_posix() in present:
+            if elem.is_dir():
+                self._push_subdir(elem, conn, present)
+                continue
+            rem_size = present.get(rel_elem.as_posix())
+            if (rem_size is not None) and (
+                (subdir.name != PACK_DIR) or (rem_size >= elem.stat().st_size)
+            ):
                 continue
             rem_abs_path = f"{conn.cwd}/{rel_elem}"
             conn.put(elem.as_posix(), rem_abs_path)
 
-    def _pull(self, conn: "Connection", complete: bool, post_status: Optional[str]):
+    def _pull(
+        self,
+        conn: "Connection",
+        complete: bool,
+        post_status: Optional[str],
+        handlers: Optional[set[str]],
+    ):
         _ls = partial(self._remote_ls, conn)
         _mv = partial(self._conn_move, conn)
         self._merge_status_cache(conn)
@@ -86,28 +142,103 @@ class RemoteMixin(DepotBase):
             runs_to_pull = remote_runs - self._get_full_run_tree(break_status)
         elif complete:
             runs_to_pull = remote_runs
+        # the rest of partially pulled runs is pulled later
+        runs_to_pull |= {
+            p.parent.name for p in self.runs_path.glob(f"*/{PARTIAL_PULL}")
+        }
         logger.info(f"pulling {len(status_dbs_to_pull)} status dbs")
         for status in status_dbs_to_pull:
             _mv(self.statuses_path / status / STATUS_DB_ZIP)
         logger.info(f"pulling {len(runs_to_pull)} runs")
         for run in runs_to_pull:
-            _mv(self.runs_path / run / EVENTS_ZIP)
+            self._pull_run(conn, self.runs_path / run, handlers)
+        self.update_latest_index()
+        if self.config.event_catalog:
+            self.update_catalog()
         needed_objects = None
-        if post_status is not None:
-            pcevs = self.get_handler_events(only_latest=False, past_runs=runs_to_pull)
-            needed_objects = set([pcev.cev.extend().output_file for pcev in pcevs])
+        if (handlers is not None) or (post_status is not None):
+            needed_objects = self._get_needed_objects(runs_to_pull, handlers)
             logger.info(f"pulling {len(needed_objects)} objects")
 
-        if (not complete) and (not needed_objects):
+        selective = (not complete) or (handlers is not None)
+        if selective and (not needed_objects):
             return runs_to_pull
 
         for obj_dir in _ls(self.object_store_path, False):
+            if obj_dir == TMP_DIR:
+                continue
+            if obj_dir == PACK_DIR:
+                # packed objects can only be pulled with their whole segment
+                self._pull_packs(conn)
+                continue
             for obj_file in _ls(self.object_store_path / obj_dir):
-                if (not complete) and (obj_file not in needed_objects):
+                if (
+                    selective
+                    and (obj_dir not in NON_OBJECT_DIRS)
+                    and (obj_file not in needed_objects)
+                ):
                     continue
                 _mv(self.object_store_path / obj_dir / obj_file)
+        if selective:
+            # delta encoded objects can only be read with their bases,
+            # that might already be here in the pulled packs
+            for base in self.object_store.get_bases(needed_objects):
+                if base in self.object_store:
+                    continue
+                base_path = self.object_store._get_full_path(base)
+                base_path.parent.mkdir(exist_ok=True, parents=True)
+                _mv(base_path)
         return runs_to_pull
 
+    def _get_needed_objects(self, runs: set[str], handlers: Optional[set[str]]):
+        _get = partial(self.get_handler_events, only_latest=False, past_runs=runs)
+        pcevs = _get() if handlers is None else chain(*map(_get, handlers))
+        return set([pcev.cev.extend().output_file for pcev in pcevs])
+
+    def _pull_run(self, conn: "Connection", run_dir: Path, handlers: Optional[set]):
+        _ls = partial(self._remote_ls, conn, only_remote=False)
+        _mv = partial(self._conn_move, conn)
+        run_files = set(_ls(run_dir))
+        for run_file in run_files & {
+            EVENTS_ZIP,
+            CONTEXT_YAML,
+            RUN_STATS_JSON,
+            *_ARCHIVE_FILES,
+        }:
+            _mv(run_dir / run_file)
+        if PARTITIONS_DIR not in run_files:
+            return
+        partitions = set(_ls(run_dir / PARTITIONS_DIR))
+        (run_dir / PARTITIONS_DIR).mkdir(exist_ok=True, parents=True)
+        for handler in partitions if handlers is None else partitions & handlers:
+            part_dir = run_dir / PARTITIONS_DIR / handler
+            part_dir.mkdir(exist_ok=True, parents=True)
+            for part_file in set(_ls(part_dir)) & _ARCHIVE_FILES:
+                _mv(part_dir / part_file)
+        if (handlers is None) or (partitions <= handlers):
+            (run_dir / PARTIAL_PULL).unlink(missing_ok=True)
+        else:
+            (run_dir / PARTIAL_PULL).touch()
+
+    def _pull_packs(self, conn: "Connection"):
+        import invoke
+
+        # segments grow while they are written, so they are compared by size
+        pack_path = self.object_store_path / PACK_DIR
+        pack_path.mkdir(exist_ok=True, parents=True)
+        rel_posix = pack_path.relative_to(self.root).as_posix()
+        find_q = f"find {rel_posix} -maxdepth 1 -type f {_FIND_SIZES}"
+        try:
+            out = conn.run(find_q, hide=True).stdout
+        except invoke.UnexpectedExit:
+            return
+        rem_sizes = _parse_sizes(out)
+        for name in sorted(rem_sizes.keys(), key=_transfer_order):
+            local_path = pack_path / name
+            local_size = local_path.stat().st_size if local_path.exists() else -1
+            if rem_sizes[name] > local_size:
+                conn.get(f"{conn.cwd}/{rel_posix}/{name}", local_path.as_posix())
+
     def _merge_status_cache(self, conn: "Connection") -> dict:
         import invoke
 
@@ -147,6 +278,17 @@ class RemoteMixin(DepotBase):
             return conn.get(rem_abs_path, local_path.as_posix())
 
 
+def _parse_sizes(find_out: str) -> dict[str, int]:
+    pairs = (line.rsplit(" ", 1) for line in find_out.splitlines() if line)
+    return {path: int(size) for path, size in pairs}
+
+
+def _transfer_order(path: Union[Path, str]):
+    # a pack index is copied before its segment,
+    # so the copied index only points to records in the copied segment
+    return not str(path).endswith(f".{INDEX_EXT}")
+
+
 def get_remote(remote: str):
     from zimmauth import ZimmAuth
 
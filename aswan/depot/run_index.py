@@ -0,0 +1,110 @@
+from functools import partial
+from hashlib import blake2b
+from importlib import import_module
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from ..models import CollEvent, partial_read
+from .event_log import iter_records
+
+if TYPE_CHECKING:
+    import numpy as np  # pragma: no cover
+
+INDEX_PARQUET = "events-index.parquet"
+INDEX_NPZ = "events-index.npz"
+INDEX_FILES = (INDEX_PARQUET, INDEX_NPZ)
+
+# one row per collection event in the event log of the run
+COLUMNS = {
+    "name": str,
+    "handler": str,
+    "status": str,
+    "timestamp": "int64",
+    "url_hash": "uint64",
+    "output_file": str,
+    "offset": "int64",
+    "length": "int64",
+}
+
+
+def hash_url(url: str) -> int:
+    return int.from_bytes(
+        blake2b(url.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def write_index(run_dir: Path, log_path: Path) -> Optional[Path]:
+    """writes the columnar index of the collection events of a run
+
+    as parquet if pyarrow is installed, as npz if only numpy, not at all otherwise
+    """
+    np = _import("numpy")
+    if np is None:
+        return None
+    cols = {k: [] for k in COLUMNS}
+    for name, blob, offset in iter_records(log_path):
+        ev = partial_read(name, partial(bytes, blob))
+        if not isinstance(ev, CollEvent):
+            continue
+        ev.extend()
+        row = [ev.handler, ev.status, ev.timestamp, hash_url(ev.url), ev.output_file]
+        for k, v in zip(COLUMNS, [name, *row, offset, len(blob)]):
+            cols[k].append(v)
+    arrs = {k: np.array(v, dtype=COLUMNS[k]) for k, v in cols.items()}
+    pa, pq = _import("pyarrow"), _import("pyarrow.parquet")
+    if pq is None:
+        out = run_dir / INDEX_NPZ
+        with out.open("wb") as fp:
+            np.savez(fp, **arrs)
+        return out
+    out = run_dir / INDEX_PARQUET
+    pq.write_table(pa.table(arrs), out)
+    return out
+
+
+def read_index(run_dir: Path) -> Optional[dict[str, "np.ndarray"]]:
+    """None if the run has no index, or it can not be read here"""
+    np = _import("numpy")
+    if np is None:
+        return None
+    parquet_path = run_dir / INDEX_PARQUET
+    if parquet_path.exists():
+        pq = _import("pyarrow.parquet")
+        if pq is None:
+            return None
+        table = pq.read_table(parquet_path)
+        return {k: table[k].to_numpy(zero_copy_only=False) for k in COLUMNS}
+    npz_path = run_dir / INDEX_NPZ
+    if npz_path.exists():
+        with np.load(npz_path) as data:
+            return {k: data[k] for k in COLUMNS}
+
+
+def filter_index(
+    index: dict[str, "np.ndarray"],
+    handler_name: Optional[str] = None,
+    statuses: Optional[Iterable[str]] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+) -> "np.ndarray":
+    """positions of the matching rows, the most recent first"""
+    import numpy as np
+
+    mask = np.ones(index["name"].shape[0], dtype=bool)
+    if handler_name is not None:
+        mask &= index["handler"] == handler_name
+    if statuses is not None:
+        mask &= np.isin(index["status"], list(statuses))
+    if since is not None:
+        mask &= index["timestamp"] >= since
+    if until is not None:
+        mask &= index["timestamp"] < until
+    rows = np.flatnonzero(mask)
+    return rows[np.argsort(-index["timestamp"][rows], kind="stable")]
+
+
+def _import(module: str):
+    try:
+        return import_module(module)
+    except ImportError:
+        return None
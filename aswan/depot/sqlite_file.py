@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import sqlalchemy as db
+from sqlalchemy.pool import NullPool
+
+# a process waits for another one writing the file instead of failing
+_BUSY_TIMEOUT = 600
+
+
+class SqliteFile:
+    """a sqlite file next to the depot, its tables created on first use"""
+
+    _meta: db.MetaData
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._engine = None
+
+    def _connect(self):
+        if self._engine is None:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            constr = f"sqlite:///{self.path.as_posix()}"
+            # no pooled connection outlives a purged depot
+            self._engine = db.create_engine(
+                constr,
+                poolclass=NullPool,
+                connect_args={"timeout": _BUSY_TIMEOUT},
+            )
+        self._meta.create_all(self._engine)
+        return self._engine.connect()
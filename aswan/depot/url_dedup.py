@@ -0,0 +1,92 @@
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from typing import TYPE_CHECKING, Optional
+from uuid import uuid4
+
+from .run_index import _import
+
+if TYPE_CHECKING:
+    import numpy as np  # pragma: no cover
+
+DEFAULT_BUFFER_SIZE = 2**16
+
+
+class UrlDedup:
+    """
+    set of 64 bit url hashes, taking about 8 bytes per hash
+
+    new hashes are buffered in a set, that is sorted into an array when full.
+    the arrays are merged like a binary counter, so there are
+    at most log(n) of them to search, and every hash is merged log(n) times
+
+    falls back to a plain set if numpy is not installed
+
+    :param spill_dir: if given, the arrays are kept in memory mapped files
+      in a temporary directory here
+    """
+
+    def __init__(
+        self, buffer_size: int = DEFAULT_BUFFER_SIZE, spill_dir: Optional[Path] = None
+    ):
+        self.buffer_size = buffer_size
+        self._np = _import("numpy")
+        self._buffer: set[int] = set()
+        # sorted arrays, the largest first
+        self._levels: list["np.ndarray"] = []
+        self._size = 0
+        self._spill_dir = None
+        if (spill_dir is not None) and (self._np is not None):
+            Path(spill_dir).mkdir(exist_ok=True, parents=True)
+            self._spill_dir = Path(mkdtemp(dir=spill_dir))
+
+    def __contains__(self, url_hash: int):
+        if url_hash in self._buffer:
+            return True
+        if not self._levels:
+            return False
+        value = self._np.uint64(url_hash)
+        for level in self._levels:
+            i = level.searchsorted(value)
+            if (i < level.shape[0]) and (level[i] == value):
+                return True
+        return False
+
+    def __len__(self):
+        return self._size
+
+    def add(self, url_hash: int) -> bool:
+        """False if the hash was already added"""
+        if url_hash in self:
+            return False
+        self._buffer.add(url_hash)
+        self._size += 1
+        if (self._np is not None) and (len(self._buffer) >= self.buffer_size):
+            self._flush()
+        return True
+
+    def close(self):
+        self._buffer = set()
+        self._levels = []
+        if self._spill_dir is not None:
+            rmtree(self._spill_dir, ignore_errors=True)
+
+    def _flush(self):
+        np = self._np
+        new = np.fromiter(self._buffer, dtype=np.uint64, count=len(self._buffer))
+        new.sort()
+        self._buffer = set()
+        while self._levels and (self._levels[-1].shape[0] <= new.shape[0]):
+            old = self._levels.pop()
+            # stable sort of two sorted runs is a linear merge
+            new = np.sort(np.concatenate([old, new]), kind="stable")
+            if isinstance(old, np.memmap):
+                Path(old.filename).unlink(missing_ok=True)
+        self._levels.append(self._store(new))
+
+    def _store(self, arr):
+        if self._spill_dir is None:
+            return arr
+        path = self._spill_dir / f"{uuid4().hex}.npy"
+        self._np.save(path, arr)
+        return self._np.load(path, mmap_mode="r")
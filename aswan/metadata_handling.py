@@ -1,61 +1,114 @@
+import os
+import socket
+import time
 from collections import defaultdict
-from functools import partial
-from typing import Iterable, List, Union
+from heapq import merge
+from itertools import chain, islice, zip_longest
+from typing import Iterable, Iterator, List, Optional, Union
 
-from sqlalchemy import func
+from sqlalchemy import bindparam, func
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import and_
 
 from .constants import Statuses
-from .models import CollEvent, RegEvent, SourceUrl
+from .models import CollEvent, RegEvent, SourceUrl, SurlCount
 
+_surls = SourceUrl.__table__
+_by_key = (_surls.c.handler == bindparam("b_handler")) & (
+    _surls.c.url == bindparam("b_url")
+)
+_no_lease = {"lease_owner": None, "lease_expires": None}
 
-def add_urls(session: Session, handler: str, urls: Iterable[str], overwrite=False):
-    url_set = set(urls)
-    filter_q = and_(SourceUrl.url.in_(tuple(url_set)), SourceUrl.handler == handler)
-    present = session.query(SourceUrl).filter(filter_q)
-    _ud = dict(current_status=Statuses.TODO)
-    if overwrite:
-        present.update(_ud, synchronize_session="fetch")
-    present_urls = set([s.url for s in present.all()])
-    ps_url = partial(SourceUrl, handler=handler, **_ud)
-    surls = [ps_url(url=url) for url in url_set if url not in present_urls]
-    session.bulk_save_objects(surls)
+
+def add_urls(
+    session: Session,
+    handler: str,
+    urls: Iterable[str],
+    overwrite=False,
+    priority: int = 0,
+):
+    _upsert_urls(session, handler, urls, overwrite, priority)
     session.commit()
 
 
 def update_sources(session: Session, handler: str, urls: Iterable[str], status):
-    base_q = session.query(SourceUrl).filter(
-        SourceUrl.handler == handler, SourceUrl.url.in_(urls)
-    )
+    # one statement executed for all urls, each finding its row by the unique key
+    params = [{"b_handler": handler, "b_url": url} for url in set(urls)]
+    if not params:
+        return
     if status in [Statuses.PROCESSED, Statuses.CACHE_LOADED]:
-        base_q.delete()
+        stmt = _surls.delete().where(_by_key)
     else:
-        base_q.update({"current_status": status})
+        stmt = _surls.update().where(_by_key)
+        stmt = stmt.values(current_status=status, **_no_lease)
+    session.connection().execute(stmt, params)
 
 
 def get_next_batch(
-    session: Session, size: int, to_processing=True, parser=list
+    session: Session,
+    size: int,
+    to_processing=True,
+    parser=list,
+    lease_owner: Optional[str] = None,
 ) -> List[SourceUrl]:
-    to_try = [Statuses.TODO, Statuses.SESSION_BROKEN]
-    query = (
-        session.query(SourceUrl)
-        .filter(SourceUrl.current_status.in_(to_try))
-        .limit(size)
-    )
-
-    surls = query.all()
+    """the most urgent urls of every handler, in equal shares
+
+    a share one handler can not fill goes to the others.
+    processing urls with an expired lease are taken again
+
+    :param lease_owner: holds the urls set to processing while they are queued,
+      without expiry, until an actor starts their lease.
+      defaults to the host and process id
+    """
+    now = time.time()
+    handlers = _iter_handlers(session) if size > 0 else []
+    frontiers = [_get_frontier(session, handler, size, now) for handler in handlers]
+    round_robin = chain.from_iterable(zip_longest(*frontiers))
+    surls = list(islice(filter(None, round_robin), size))
     if to_processing:
+        owner = lease_owner or get_lease_owner()
         for surl in surls:
             surl.current_status = Statuses.PROCESSING
+            surl.lease_owner = owner
+            surl.lease_expires = None
         session.commit()
     return parser(surls)
 
 
+def start_lease(
+    session: Session,
+    handler: str,
+    url: str,
+    lease_seconds: Optional[float] = None,
+    lease_owner: Optional[str] = None,
+    commit=True,
+):
+    """the processing url is leased from now by the actor that picked it up
+
+    :param lease_seconds: the url is handed out again after this long,
+      if it is still processing. it never expires if None
+    """
+    expires = None if lease_seconds is None else time.time() + lease_seconds
+    stmt = _surls.update().where(
+        _by_key, _surls.c.current_status == Statuses.PROCESSING
+    )
+    stmt = stmt.values(
+        lease_owner=lease_owner or get_lease_owner(), lease_expires=expires
+    )
+    session.connection().execute(stmt, [{"b_handler": handler, "b_url": url}])
+    if commit:
+        session.commit()
+
+
+def get_lease_owner() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
 def get_grouped_surls(session: Session):
+    """status, handler and count of the source urls, from the maintained counts"""
     return (
-        session.query(SourceUrl.current_status, SourceUrl.handler, func.count())
-        .group_by(SourceUrl.current_status, SourceUrl.handler)
+        session.query(SurlCount.current_status, SurlCount.handler, SurlCount.count)
+        .filter(SurlCount.count > 0)
         .all()
     )
 
@@ -63,12 +116,17 @@ def get_grouped_surls(session: Session):
 def reset_surls(session: Session, statuses):
     session.query(SourceUrl).filter(
         SourceUrl.current_status.in_(tuple(statuses))
-    ).update({"current_status": Statuses.TODO}, synchronize_session="fetch")
+    ).update(
+        {"current_status": Statuses.TODO, **_no_lease}, synchronize_session="fetch"
+    )
     session.commit()
 
 
 def integrate_events(
-    session: Session, events: Iterable[Union[RegEvent, CollEvent]], dump_dir=None
+    session: Session,
+    events: Iterable[Union[RegEvent, CollEvent]],
+    dump_dir=None,
+    commit=True,
 ):
     reg_urls = defaultdict(list)
     coll_urls = defaultdict(list)
@@ -76,17 +134,83 @@ def integrate_events(
         if dump_dir:
             event.dump(dump_dir)
         if isinstance(event, RegEvent):
-            suffix = event.overwrite
+            # events read from old records have no priority
+            suffix = (event.overwrite, event.priority or 0)
             dic = reg_urls
         elif isinstance(event, CollEvent):
-            suffix = event.status
+            suffix = (event.status,)
             dic = coll_urls
-        dic[(event.handler, suffix)].append(event.url)
+        dic[(event.handler, *suffix)].append(event.url)
 
     for url_dic, fun in [
         (coll_urls, update_sources),
-        (reg_urls, add_urls),
+        (reg_urls, _upsert_urls),
     ]:
-        for (handler, suff), urls in url_dic.items():
-            fun(session, handler, urls, suff)
-    session.commit()
+        for (handler, *suff), urls in url_dic.items():
+            fun(session, handler, urls, *suff)
+    if commit:
+        session.commit()
+
+
+def _upsert_urls(
+    session: Session, handler: str, urls: Iterable[str], overwrite, priority=0
+):
+    rows = [
+        {
+            "url": url,
+            "handler": handler,
+            "current_status": Statuses.TODO,
+            "priority": priority,
+            **_no_lease,
+        }
+        for url in set(urls)
+    ]
+    if not rows:
+        return
+    stmt = insert(_surls)
+    keys = [_surls.c.url, _surls.c.handler]
+    if overwrite:
+        cols = ["current_status", "priority", *_no_lease.keys()]
+        set_ = {k: stmt.excluded[k] for k in cols}
+        stmt = stmt.on_conflict_do_update(index_elements=keys, set_=set_)
+    else:
+        # registering again can only make a url more urgent
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={"priority": stmt.excluded.priority},
+            where=_surls.c.priority < stmt.excluded.priority,
+        )
+    session.connection().execute(stmt, rows)
+
+
+def _iter_handlers(session: Session) -> Iterator[str]:
+    # one seek on the frontier index per handler, instead of a scan
+    query = session.query(func.min(SourceUrl.handler))
+    handler = query.scalar()
+    while handler is not None:
+        yield handler
+        handler = query.filter(SourceUrl.handler > handler).scalar()
+
+
+def _get_frontier(
+    session: Session, handler: str, size: int, now: float
+) -> List[SourceUrl]:
+    # a query per status keeps the order of the index
+    # only as many processing urls as are in flight are checked for expiry
+    status_filters = [
+        [SourceUrl.current_status == Statuses.TODO],
+        [SourceUrl.current_status == Statuses.SESSION_BROKEN],
+        [
+            SourceUrl.current_status == Statuses.PROCESSING,
+            SourceUrl.lease_expires < now,
+        ],
+    ]
+    queries = [
+        session.query(SourceUrl)
+        .filter(SourceUrl.handler == handler, *filters)
+        .order_by(SourceUrl.priority.desc(), SourceUrl.cid)
+        .limit(size)
+        for filters in status_filters
+    ]
+    surls = merge(*[q.all() for q in queries], key=lambda s: (-s.priority, s.cid))
+    return list(islice(surls, size))
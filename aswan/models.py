@@ -1,9 +1,10 @@
 import datetime as dt
-from dataclasses import asdict, dataclass, field
-from functools import total_ordering
+import struct
+from dataclasses import dataclass, field, fields
+from functools import cache, total_ordering
 from hashlib import md5
 from pathlib import Path
-from typing import Callable, Dict, Iterable, Type, Union
+from typing import Callable, Dict, Iterable, Tuple, Type, Union
 
 import sqlalchemy as db
 from sqlalchemy.orm import declarative_base
@@ -12,6 +13,10 @@ Base = declarative_base()
 
 BLOB_JOIN = b"\n"
 NAME_JOIN = "-"
+# text blobs never start with a null byte
+BINARY_MAGIC = b"\x00"
+# strings are packed as their length, followed by the utf-8 bytes
+_STRUCT_CODES = {int: "q", bool: "?", str: "I"}
 
 
 class SourceUrl(Base):
@@ -21,13 +26,63 @@ class SourceUrl(Base):
     url = db.Column(db.String)
     handler = db.Column(db.String)
     current_status = db.Column(db.String)
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # a processing url is handed out again after its lease expires
+    lease_owner = db.Column(db.String)
+    lease_expires = db.Column(db.Float)
     uix = db.UniqueConstraint(url, handler)
+    # the frontier of each handler, most urgent first
+    ix_frontier = db.Index(
+        "ix_source_urls_frontier", handler, current_status, priority.desc()
+    )
 
     def __repr__(self):
         return f"SourceURL: {self.handler}: {self.url} - {self.current_status}"
 
 
-@dataclass
+class SurlCount(Base):
+    """number of source urls of a handler in a status
+
+    kept up to date by triggers on the source urls, in the same transaction
+    """
+
+    __tablename__ = "surl_counts"
+
+    handler = db.Column(db.String, primary_key=True)
+    current_status = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+_COUNT_UP = """
+    INSERT INTO surl_counts (handler, current_status, count)
+    VALUES (NEW.handler, NEW.current_status, 1)
+    ON CONFLICT (handler, current_status) DO UPDATE SET count = count + 1;"""
+_COUNT_DOWN = """
+    UPDATE surl_counts SET count = count - 1
+    WHERE handler = OLD.handler AND current_status = OLD.current_status;"""
+_COUNTED_CHANGE = (
+    "OLD.handler IS NOT NEW.handler OR OLD.current_status IS NOT NEW.current_status"
+)
+SURL_COUNT_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON source_urls
+    {cond} BEGIN {body}
+    END"""
+    for name, event, cond, body in [
+        ("count_surl_insert", "INSERT", "", _COUNT_UP),
+        ("count_surl_delete", "DELETE", "", _COUNT_DOWN),
+        (
+            "count_surl_update",
+            "UPDATE OF handler, current_status",
+            f"WHEN {_COUNTED_CHANGE}",
+            _COUNT_DOWN + _COUNT_UP,
+        ),
+    ]
+]
+for _trigger in SURL_COUNT_TRIGGERS:
+    db.event.listen(SurlCount.__table__, "after_create", db.DDL(_trigger))
+
+
+@dataclass(slots=True)
 class _Event:
     url: str
     handler: str
@@ -35,17 +90,30 @@ class _Event:
     _extended: bool = field(default=False, init=False)
 
     __name_keys__ = ["handler"]
+    # blob keys added later, stored after all others so older blobs still load
+    __late_keys__ = []
     __name_prefix__ = ""
 
     def dump(self, dir_path: Path):
+        filename, blob = self.to_record()
+        (dir_path / filename).write_bytes(blob)
+        return self
+
+    def to_record(self, binary: bool = False) -> Tuple[str, bytes]:
+        """name and blob of the event, as stored in a file or an event log
+
+        :param binary: the blob is struct packed instead of newline joined text
+        """
         name_parts = map(_to_str, [getattr(self, k) for k in self.__name_keys__])
-        blob_parts = map(_to_bytes, [getattr(self, k) for k in self._blob_keys()])
-        blob = BLOB_JOIN.join(blob_parts)
+        values = [getattr(self, k) for k in self._blob_keys()]
+        if binary:
+            blob = _schema(type(self)).pack(values)
+        else:
+            blob = BLOB_JOIN.join(map(_to_bytes, values))
         filename = NAME_JOIN.join(
             [self.__name_prefix__, *name_parts, md5(blob).hexdigest()]
         )
-        (dir_path / filename).write_bytes(blob)
-        return self
+        return filename, blob
 
     def extend(self):
         if self._extended:
@@ -53,41 +121,44 @@ class _Event:
         self._extended = True
         blob = self._read_fun()
         self._read_fun = None  # som might not be pickleable
-        for k, v in zip(self._blob_keys(), blob.split(BLOB_JOIN)):
-            setattr(self, k, _from_bytes(v, self._ann()[k]))
+        for k, v in zip(self._blob_keys(), _schema(type(self)).unpack(blob)):
+            setattr(self, k, v)
         return self
 
     def dict(self):
-        return {k: v for k, v in asdict(self.extend()).items() if k in self._ann()}
+        self.extend()
+        return {k: getattr(self, k) for k in _schema(type(self)).field_keys}
 
     @classmethod
     def partial_load(cls, name: str, blob_loader: Callable):
         main = {}
         for k, val in zip(cls.__name_keys__, name.split(NAME_JOIN)[1:-1]):
             main[k] = _from_str(val, cls._ann()[k])
-        out = cls(**main, **{k: None for k in cls._blob_keys()})
+        late = cls.__late_keys__
+        out = cls(**main, **{k: None for k in cls._blob_keys() if k not in late})
         out._read_fun = blob_loader
         return out
 
     @classmethod
-    def _blob_keys(cls):
-        return filter(lambda k: k not in cls.__name_keys__, cls._ann().keys())
+    def _blob_keys(cls) -> Tuple[str, ...]:
+        return _schema(cls).blob_keys
 
     @classmethod
     def _ann(cls) -> Dict[str, type]:
-        _full_ann_items = {**cls.__annotations__, **_Event.__annotations__}.items()
-        return {k: v for k, v in _full_ann_items if not k.startswith("_")}
+        return _schema(cls).types
 
 
-@dataclass
+@dataclass(slots=True)
 class RegEvent(_Event):
     overwrite: bool = False
+    priority: int = 0
 
+    __late_keys__ = ["priority"]
     __name_prefix__ = "r"
 
 
 @total_ordering
-@dataclass
+@dataclass(slots=True)
 class CollEvent(_Event):
     status: str
     timestamp: int
@@ -111,6 +182,61 @@ class CollEvent(_Event):
         return dt.datetime.fromtimestamp(self.timestamp).isoformat()
 
 
+class _Schema:
+    """field metadata of an event type, computed once"""
+
+    def __init__(self, ev_type: Type[_Event]):
+        _full_ann_items = {**ev_type.__annotations__, **_Event.__annotations__}.items()
+        self.types = {k: v for k, v in _full_ann_items if not k.startswith("_")}
+        self.field_keys = tuple(f.name for f in fields(ev_type) if f.name in self.types)
+        late = ev_type.__late_keys__
+        skipped = [*ev_type.__name_keys__, *late]
+        self.blob_keys = (*[k for k in self.types if k not in skipped], *late)
+        self.blob_types = tuple(self.types[k] for k in self.blob_keys)
+        self.n_early = len(self.blob_keys) - len(late)
+        codes = [_STRUCT_CODES[t] for t in self.blob_types]
+        assert "I" not in codes[self.n_early :], "late keys can not be strings"
+        self.struct = struct.Struct(f"<{''.join(codes[:self.n_early])}")
+        # packed after the strings
+        self.late_struct = struct.Struct(f"<{''.join(codes[self.n_early:])}")
+
+    def pack(self, values: list) -> bytes:
+        early, late = values[: self.n_early], values[self.n_early :]
+        strings = [v.encode("utf-8") for v in early if isinstance(v, str)]
+        str_lens = iter(map(len, strings))
+        packed = [next(str_lens) if isinstance(v, str) else v for v in early]
+        return b"".join(
+            [
+                BINARY_MAGIC,
+                self.struct.pack(*packed),
+                *strings,
+                self.late_struct.pack(*late),
+            ]
+        )
+
+    def unpack(self, blob: bytes) -> list:
+        if not blob.startswith(BINARY_MAGIC):
+            return [
+                _from_bytes(v, t)
+                for v, t in zip(blob.split(BLOB_JOIN), self.blob_types)
+            ]
+        packed = self.struct.unpack_from(blob, len(BINARY_MAGIC))
+        pos = len(BINARY_MAGIC) + self.struct.size
+        out = []
+        for v, dtype in zip(packed, self.blob_types):
+            if dtype == str:
+                v, pos = blob[pos : pos + v].decode("utf-8"), pos + v
+            out.append(v)
+        if len(blob) >= pos + self.late_struct.size:
+            out.extend(self.late_struct.unpack_from(blob, pos))
+        return out
+
+
+@cache
+def _schema(ev_type: Type[_Event]) -> _Schema:
+    return _Schema(ev_type)
+
+
 def partial_read_path(file_path: Path) -> Union[CollEvent, RegEvent]:
     return partial_read(file_path.name, file_path.read_bytes)
 
@@ -130,7 +256,7 @@ def _to_str(val):
     if isinstance(val, bool):
         return "T" if val else "F"
     if isinstance(val, int):
-        return hex(val)[2:]
+        return format(val, "x")
     assert isinstance(val, str), f"is {type(val)} - {val}"
     return val
 
@@ -0,0 +1,4 @@
+# flake8: noqa
+from .base import ObjectStore
+from .packs import PackStore
+from .streams import ObjectWriter, StoredObject
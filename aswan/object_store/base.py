@@ -0,0 +1,552 @@
+import json
+import os
+import pickle
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from hashlib import md5
+from io import BytesIO
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from typing import (
+    BinaryIO,
+    Callable,
+    Container,
+    Generator,
+    Iterable,
+    Iterator,
+    Optional,
+    Union,
+)
+
+from bs4 import BeautifulSoup
+
+from .cache import ByteLRU
+from .codecs import (
+    CODECS,
+    DELTA_CODEC,
+    DELTA_DIR,
+    DICT_DIR,
+    DICT_EXT,
+    ZIP_CODEC,
+    ZIP_ENTRY,
+    CodecBase,
+    DeflateCodec,
+    DeltaCodec,
+    decode_header,
+    encode_header,
+    is_zip,
+    read_header,
+)
+from .hashing import DEFAULT_HASH, get_hash, strip_tag, tag_digest
+from .packs import DEFAULT_SEGMENT_SIZE, PACK_DIR, PackStore
+from .streams import TMP_DIR, ObjectWriter, StoredObject, open_decoded
+
+# directories next to the prefix dirs, that do not hold one object per file
+NON_OBJECT_DIRS = (PACK_DIR, DICT_DIR, TMP_DIR, DELTA_DIR)
+# the store of a read_many worker process
+_worker_store: Optional["ObjectStore"] = None
+
+
+class _Exts:
+    txt = "txt"
+    pkl = "pkl"
+    blob = "blob"
+    json = "json"
+
+
+class ObjectStore:
+    """
+    class for storing and retrieving objects downloaded
+
+    :param root: object store root
+    :param hash_fun: hash function or one of `sha3`, `blake2b` and `xxh3`.
+      object names record the named functions other than sha3
+    :param packed: append new objects to segment files instead of
+      writing a zip file per object
+    :param segment_size: size of segment files in bytes if packed
+    :param codec: compression of new objects, one of `zip`, `deflate`, `zstd`,
+      `brotli`, `lz4` and `none`. objects are readable regardless of this setting
+    :param cache_size: size in bytes of the cache of decoded objects, 0 disables it
+    :param write_behind: if positive, dumps only hash the object and a writer
+      thread compresses and writes it, with at most this many objects queued
+    :param delta_chain_length: if positive, objects dumped with a `delta_key`
+      are stored as zstd deltas against the last full object of that key,
+      and a new full base is stored after this many deltas
+    """
+
+    def __init__(
+        self,
+        root,
+        hash_fun=DEFAULT_HASH,
+        prefix_chars: int = 2,
+        compression=zipfile.ZIP_DEFLATED,
+        timeout=60,
+        packed: bool = False,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        codec: str = ZIP_CODEC,
+        cache_size: int = 0,
+        write_behind: int = 0,
+        delta_chain_length: int = 0,
+    ):
+        self.root_path = Path(root)
+        self.hash_fun, self._hash_tag = get_hash(hash_fun)
+        self.prefix_chars = prefix_chars
+        self.timeout = timeout
+        self.packed = packed
+        self.codec = codec
+        self._comp = compression
+        self._packs = PackStore(self.root_path / PACK_DIR, segment_size)
+        self._dict_path = self.root_path / DICT_DIR
+        self._dicts: dict[str, bytes] = {}
+        self._current_dicts: dict[str, str] = {}
+        self._cache = ByteLRU(cache_size)
+        self.write_behind = write_behind
+        self._pending: dict[str, bytes] = {}
+        self._queue: Optional[Queue] = None
+        self._writer: Optional[Thread] = None
+        self._writer_error: Optional[Exception] = None
+        self.delta_chain_length = delta_chain_length
+        self._delta_path = self.root_path / DELTA_DIR
+
+    def __contains__(self, name: str):
+        """whether the object is stored here, packed or in its own file"""
+        if self._get_full_path(name).exists():
+            return True
+        try:
+            self._packs.locate(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def __getstate__(self):
+        return self.__dict__ | {"_pending": {}, "_queue": None, "_writer": None}
+
+    def purge(self, clear_dirs=True):
+        self._packs.purge()
+        self._cache.clear()
+        for _dir in self.root_path.iterdir():
+            for p in _dir.iterdir():
+                p.unlink()
+            _dir.rmdir()
+        if clear_dirs:
+            self.root_path.rmdir()
+
+    def dump(
+        self,
+        obj: Union[list, dict, str, bytes],
+        dict_key: Optional[str] = None,
+        delta_key: Optional[str] = None,
+    ):
+        if isinstance(obj, StoredObject):
+            return obj
+        if isinstance(obj, BeautifulSoup):
+            # can result in infinite recursion for pickling, dunno why
+            obj = obj.encode("utf-8")
+        for _t, fun in [
+            ((list, dict), self.dump_json),
+            (str, self.dump_str),
+            (bytes, self.dump_bytes),
+        ]:
+            if isinstance(obj, _t):
+                return fun(obj, dict_key=dict_key, delta_key=delta_key)
+        return self.dump_pickle(obj, dict_key=dict_key, delta_key=delta_key)
+
+    def dump_json(self, obj: Union[list, dict], dict_key=None, delta_key=None) -> str:
+        return self.dump_str(json.dumps(obj), _Exts.json, dict_key, delta_key)
+
+    def dump_str(self, s: str, ext=None, dict_key=None, delta_key=None) -> str:
+        buf = s.encode("utf-8")
+        return self.dump_bytes(buf, ext or _Exts.txt, dict_key, delta_key)
+
+    def dump_pickle(self, obj, dict_key=None, delta_key=None) -> str:
+        return self.dump_bytes(pickle.dumps(obj), _Exts.pkl, dict_key, delta_key)
+
+    def dump_bytes(self, buf: bytes, ext=None, dict_key=None, delta_key=None) -> str:
+        """dict_key selects the latest dictionary trained for that key, if any
+
+        successive versions dumped with the same delta_key are delta encoded
+        """
+        full_name = self._get_name(self.hash_fun(buf).hexdigest(), ext or _Exts.blob)
+        if self.write_behind:
+            self._pending[full_name] = buf
+            self._enqueue(self._write_pending, full_name, dict_key, delta_key)
+        else:
+            self._write(full_name, buf, dict_key, delta_key)
+        return full_name
+
+    def open_write(self, ext=None, dict_key=None) -> ObjectWriter:
+        """writable stream for large objects, that are never held in memory
+
+        the name of the object is available as `name` after the stream is closed
+        """
+        return ObjectWriter(self, ext or _Exts.blob, dict_key)
+
+    def open_read(self, name: str) -> BinaryIO:
+        """readable stream of the decoded object"""
+        buf = self._pending.get(name)
+        if buf is None:
+            buf = self._cache.get(name)
+        if buf is not None:
+            return BytesIO(buf)
+        fp, length = self._open_raw(name)
+        return open_decoded(fp, length, self._get_zdict)
+
+    def get_bases(self, names: Iterable[str]) -> set[str]:
+        """names of the objects that the given delta encoded objects are based on
+
+        missing objects are skipped
+        """
+        out = set()
+        for name in filter(None, names):
+            try:
+                fp, _ = self._open_raw(name)
+            except FileNotFoundError:
+                continue
+            with fp:
+                header = read_header(fp)
+            if (header is not None) and isinstance(header[0], DeltaCodec):
+                out.add(header[1])
+        return out
+
+    def when_written(self, fun: Callable, *args):
+        """calls fun once all the objects dumped before are written"""
+        if self.write_behind:
+            self._enqueue(fun, *args)
+        else:
+            fun(*args)
+
+    def flush(self):
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_writer_error()
+
+    def read(self, name: str):
+        _ext = name.split(".")[-1]
+        return {
+            _Exts.blob: self.read_bytes,
+            _Exts.json: self.read_json,
+            _Exts.txt: self.read_str,
+            _Exts.pkl: self.read_pickle,
+        }[_ext](name)
+
+    def read_json(self, name: str) -> Union[list, dict]:
+        return json.loads(self.read_str(name))
+
+    def read_str(self, name: str) -> str:
+        return self.read_bytes(name).decode("utf-8")
+
+    def read_pickle(self, name: str):
+        return pickle.loads(self.read_bytes(name))
+
+    def read_bytes(self, name: str) -> bytes:
+        buf = self._pending.get(name)
+        if buf is None:
+            buf = self._cache.get(name)
+        if buf is not None:
+            return buf
+        readers = [self._read_packed, self._read_file]
+        if not (self.packed or (name in self._packs)):
+            readers.reverse()
+        try:
+            buf = readers[0](name)
+        except FileNotFoundError:
+            # mixed stores are possible after migrating or changing settings
+            buf = readers[1](name)
+        self._cache.put(name, buf)
+        return buf
+
+    def read_many(
+        self, names: Iterable[str], workers: Optional[int] = None, processes=False
+    ) -> Iterator:
+        """reads and decodes objects on a pool, yielding them in the order of names
+
+        at most a few times the number of workers are read ahead
+        """
+        workers = workers or os.cpu_count()
+        if processes:
+            # the store is sent to each worker once, not with every name
+            executor = ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(self,)
+            )
+            read = _read_in_worker
+        else:
+            executor, read = ThreadPoolExecutor(workers), self.read
+        with executor:
+            futures = deque()
+            for name in names:
+                futures.append(executor.submit(read, name))
+                if len(futures) >= workers * 4:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+    def close(self):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._queue = self._writer = None
+        self._packs.close()
+        self._raise_writer_error()
+
+    def train_dictionary(
+        self, key: str, names: Iterable[str], dict_size: int = 2**17
+    ) -> str:
+        """trains a zstd dictionary on the given objects
+
+        later dumps with `dict_key=key` use it, if the codec takes dictionaries
+
+        returns the id of the new dictionary
+        """
+        import zstandard
+
+        samples = [*map(self.read_bytes, names)]
+        zdict = zstandard.train_dictionary(dict_size, samples).as_bytes()
+        dict_id = f"{key}-{time.time_ns()}"
+        self._dict_path.mkdir(exist_ok=True, parents=True)
+        (self._dict_path / f"{dict_id}.{DICT_EXT}").write_bytes(zdict)
+        self._dicts[dict_id] = zdict
+        self._current_dicts[key] = dict_id
+        return dict_id
+
+    def migrate_to_packs(self) -> int:
+        """moves all objects stored as separate files into packs
+
+        returns the number of objects moved
+        """
+        moved = 0
+        self._packs.refresh()
+        for _dir in self._iter_prefix_dirs():
+            for p in _dir.iterdir():
+                if p.name not in self._packs:
+                    self._packs.put(p.name, self._encode(self._read_file(p.name)))
+                p.unlink()
+                moved += 1
+            _dir.rmdir()
+        return moved
+
+    def sweep(
+        self, live: Container[str], archive: Optional["ObjectStore"] = None
+    ) -> int:
+        """removes all the objects that are not live and compacts the packs
+
+        assumes no other process writes to the store meanwhile
+
+        :param archive: removed objects are moved here, if given
+        :return: the number of bytes reclaimed
+        """
+        self.flush()
+        if self._delta_path.exists():
+            live = {*live, *self.get_bases(live)}
+            for head_path in self._delta_path.iterdir():
+                if head_path.read_text().split()[0] not in live:
+                    head_path.unlink()
+        on_drop = None if archive is None else archive._put_raw
+        reclaimed = 0
+        for _dir in [*self._iter_prefix_dirs()]:
+            for p in _dir.iterdir():
+                if p.name in live:
+                    continue
+                reclaimed += p.stat().st_size
+                if on_drop is not None:
+                    on_drop(p.name, p.read_bytes())
+                p.unlink()
+            if not any(_dir.iterdir()):
+                _dir.rmdir()
+        reclaimed += self._packs.compact(live, on_drop)
+        self._cache.clear()
+        return reclaimed
+
+    def _write(
+        self,
+        full_name: str,
+        buf: bytes,
+        dict_key: Optional[str],
+        delta_key: Optional[str] = None,
+    ):
+        full_path = self._get_full_path(full_name)
+        if (full_name in self._packs) if self.packed else full_path.exists():
+            return
+        payload = None
+        if delta_key and self.delta_chain_length:
+            payload = self._encode_delta(full_name, buf, delta_key)
+        if (payload is None) and (self.packed or (self.codec != ZIP_CODEC)):
+            payload = self._encode(buf, dict_key)
+        if payload is not None:
+            return self._put_raw(full_name, payload)
+        full_path.parent.mkdir(exist_ok=True, parents=True)
+        with self._zip(full_path, "w") as zip_ctx:
+            zip_ctx.writestr(ZIP_ENTRY, buf)
+
+    def _encode_delta(self, full_name: str, buf: bytes, delta_key: str):
+        """delta against the base of the key, None if a new base is due"""
+        head_path = self._delta_path / md5(delta_key.encode("utf-8")).hexdigest()
+        try:
+            base, count = head_path.read_text().split()
+            if int(count) < self.delta_chain_length:
+                delta = DELTA_CODEC.compress(buf, self.read_bytes(base))
+                self._set_delta_head(head_path, base, int(count) + 1)
+                return encode_header(DELTA_CODEC, base) + delta
+        except FileNotFoundError:
+            pass
+        self._set_delta_head(head_path, full_name, 0)
+
+    def _set_delta_head(self, head_path: Path, base: str, count: int):
+        self._delta_path.mkdir(exist_ok=True)
+        tmp_path = head_path.with_suffix(f".{os.getpid()}")
+        tmp_path.write_text(f"{base} {count}")
+        tmp_path.replace(head_path)
+
+    def _put_raw(self, full_name: str, payload: bytes):
+        """stores an already encoded object"""
+        if self.packed:
+            if full_name not in self._packs:
+                self._packs.put(full_name, payload)
+            return
+        full_path = self._get_full_path(full_name)
+        full_path.parent.mkdir(exist_ok=True, parents=True)
+        full_path.write_bytes(payload)
+
+    def _store_file(self, path: Path, full_name: str):
+        """moves a file with an encoded object into the store"""
+        if self.packed:
+            if full_name not in self._packs:
+                self._packs.put_file(full_name, path)
+            path.unlink()
+            return
+        full_path = self._get_full_path(full_name)
+        if full_path.exists():
+            path.unlink()
+            return
+        full_path.parent.mkdir(exist_ok=True, parents=True)
+        path.replace(full_path)
+
+    def _write_pending(self, full_name: str, *keys: Optional[str]):
+        buf = self._pending.get(full_name)
+        if buf is not None:  # same object might have been queued twice
+            self._write(full_name, buf, *keys)
+            self._pending.pop(full_name, None)
+
+    def _enqueue(self, fun: Callable, *args):
+        self._raise_writer_error()
+        if self._writer is None:
+            self._queue = Queue(self.write_behind)
+            self._writer = Thread(target=self._drain, daemon=True)
+            self._writer.start()
+        self._queue.put((fun, args))
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            fun, args = item
+            try:
+                fun(*args)
+            except Exception as e:
+                self._writer_error = e
+            self._queue.task_done()
+
+    def _raise_writer_error(self):
+        if self._writer_error is not None:
+            err, self._writer_error = self._writer_error, None
+            raise err
+
+    def _read_packed(self, name: str) -> bytes:
+        return self._decode(self._packs.get(name))
+
+    def _read_file(self, name: str) -> bytes:
+        return self._decode(self._get_full_path(name).read_bytes())
+
+    def _open_raw(self, name: str) -> tuple[BinaryIO, Optional[int]]:
+        openers = [self._packs.open, self._open_file]
+        if not (self.packed or (name in self._packs)):
+            openers.reverse()
+        try:
+            return openers[0](name)
+        except FileNotFoundError:
+            return openers[1](name)
+
+    def _open_file(self, name: str) -> tuple[BinaryIO, None]:
+        return self._get_full_path(name).open("rb"), None
+
+    def _encode(self, buf: bytes, dict_key: Optional[str] = None) -> bytes:
+        codec, dict_id, zdict = self._get_codec(dict_key)
+        return encode_header(codec, dict_id) + codec.compress(buf, zdict)
+
+    def _get_codec(
+        self, dict_key: Optional[str]
+    ) -> tuple[CodecBase, str, Optional[bytes]]:
+        # zip only makes sense as a file, the same deflate is used otherwise
+        codec = CODECS[DeflateCodec.name if self.codec == ZIP_CODEC else self.codec]
+        dict_id = self._get_dict_id(dict_key) if codec.takes_dict else ""
+        zdict = self._load_dict(dict_id) if dict_id else None
+        return codec, dict_id, zdict
+
+    def _decode(self, payload: bytes) -> bytes:
+        if is_zip(payload):
+            with zipfile.ZipFile(BytesIO(payload)) as zip_ctx:
+                return zip_ctx.read(ZIP_ENTRY)
+        codec, dict_id, start = decode_header(payload)
+        return codec.decompress(payload[start:], self._get_zdict(codec, dict_id))
+
+    def _get_zdict(self, codec: CodecBase, dict_id: str) -> Optional[bytes]:
+        if not dict_id:
+            return None
+        if isinstance(codec, DeltaCodec):
+            return self.read_bytes(dict_id)
+        return self._load_dict(dict_id)
+
+    def _get_dict_id(self, key: Optional[str]) -> str:
+        if not key:
+            return ""
+        if key not in self._current_dicts:
+            ids = [p.stem for p in self._dict_path.glob(f"{key}-*.{DICT_EXT}")]
+            self._current_dicts[key] = max(ids, key=_dict_timestamp, default="")
+        return self._current_dicts[key]
+
+    def _load_dict(self, dict_id: str) -> bytes:
+        if dict_id not in self._dicts:
+            dict_file = self._dict_path / f"{dict_id}.{DICT_EXT}"
+            self._dicts[dict_id] = dict_file.read_bytes()
+        return self._dicts[dict_id]
+
+    def _iter_prefix_dirs(self):
+        if not self.root_path.exists():
+            return
+        for _dir in self.root_path.iterdir():
+            if _dir.name not in NON_OBJECT_DIRS:
+                yield _dir
+
+    def _get_name(self, hexdigest: str, ext: str) -> str:
+        return _join(".", tag_digest(self._hash_tag, hexdigest), ext)
+
+    def _get_full_path(self, full_name: str) -> Path:
+        dirname = strip_tag(full_name)[: self.prefix_chars]
+        return self.root_path / dirname / full_name
+
+    @contextmanager
+    def _zip(self, full_path, mode) -> Generator[zipfile.ZipFile, None, None]:
+        with zipfile.ZipFile(full_path, mode, compression=self._comp) as zip_ctx:
+            yield zip_ctx
+
+
+def _dict_timestamp(dict_id: str):
+    return int(dict_id.split("-")[-1])
+
+
+def _join(sep: str, *elems):
+    return sep.join(filter(None, elems))
+
+
+def _init_worker(store: ObjectStore):
+    global _worker_store
+    _worker_store = store
+
+
+def _read_in_worker(name: str):
+    return _worker_store.read(name)
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+
+class ByteLRU:
+    """
+    least recently used cache of decoded objects, limited by their total size
+
+    :param max_bytes: the cache is disabled if 0
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.max_bytes:
+            return None
+        with self._lock:
+            buf = self._items.get(key)
+            if buf is not None:
+                self._items.move_to_end(key)
+            return buf
+
+    def put(self, key: str, buf: bytes):
+        if len(buf) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            self.size += len(buf) - (0 if old is None else len(old))
+            self._items[key] = buf
+            while self.size > self.max_bytes:
+                _, dropped = self._items.popitem(last=False)
+                self.size -= len(dropped)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
@@ -0,0 +1,213 @@
+import struct
+import zlib
+from typing import BinaryIO, Callable, Optional
+
+import brotli
+
+ZIP_CODEC = "zip"
+DICT_DIR = "dicts"
+DICT_EXT = "zdict"
+DELTA_DIR = "delta-heads"
+
+ZIP_MAGIC = b"PK\x03\x04"
+ZIP_ENTRY = "content"
+_MAGIC = b"ASWN"
+# codec id, dictionary id length - followed by the ascii dictionary id
+_HEAD = struct.Struct("<BB")
+
+
+class CodecBase:
+    name: str = ""
+    cid: int = 0
+    takes_dict: bool = False
+
+    def compress(self, buf: bytes, zdict: Optional[bytes] = None) -> bytes:
+        return buf
+
+    def decompress(self, buf: bytes, zdict: Optional[bytes] = None) -> bytes:
+        return buf
+
+    def compressobj(self, zdict: Optional[bytes] = None):
+        """incremental compressor with `compress(chunk)` and `flush()`"""
+        return _Incremental(lambda chunk: chunk)
+
+    def decompressobj(self, zdict: Optional[bytes] = None):
+        """incremental decompressor with `decompress(chunk)` and `flush()`"""
+        return _Incremental(lambda chunk: chunk)
+
+
+class NoCodec(CodecBase):
+    name = "none"
+
+
+class DeflateCodec(CodecBase):
+    name = "deflate"
+    cid = 1
+    takes_dict = True
+
+    def compress(self, buf, zdict=None):
+        comp = self.compressobj(zdict)
+        return comp.compress(buf) + comp.flush()
+
+    def decompress(self, buf, zdict=None):
+        decomp = self.decompressobj(zdict)
+        return decomp.decompress(buf) + decomp.flush()
+
+    def compressobj(self, zdict=None):
+        return zlib.compressobj(zdict=zdict) if zdict else zlib.compressobj()
+
+    def decompressobj(self, zdict=None):
+        return zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+
+
+class ZstdCodec(CodecBase):
+    name = "zstd"
+    cid = 2
+    takes_dict = True
+
+    def compress(self, buf, zdict=None):
+        return self._zstd().ZstdCompressor(dict_data=self._dict(zdict)).compress(buf)
+
+    def decompress(self, buf, zdict=None):
+        decomp = self._zstd().ZstdDecompressor(dict_data=self._dict(zdict))
+        return decomp.decompress(buf)
+
+    def compressobj(self, zdict=None):
+        return self._zstd().ZstdCompressor(dict_data=self._dict(zdict)).compressobj()
+
+    def decompressobj(self, zdict=None):
+        decomp = self._zstd().ZstdDecompressor(dict_data=self._dict(zdict))
+        return _Incremental(decomp.decompressobj().decompress)
+
+    def _dict(self, zdict: Optional[bytes]):
+        return self._zstd().ZstdCompressionDict(zdict) if zdict else None
+
+    @staticmethod
+    def _zstd():
+        import zstandard
+
+        return zstandard
+
+
+class DeltaCodec(ZstdCodec):
+    """zstd with the decoded base object as raw content dictionary
+
+    the dictionary id in the header is the name of the base object
+    """
+
+    name = "delta"
+    cid = 5
+
+    def _dict(self, zdict):
+        zstd = self._zstd()
+        raw = zstd.DICT_TYPE_RAWCONTENT
+        return zstd.ZstdCompressionDict(zdict, dict_type=raw) if zdict else None
+
+
+class BrotliCodec(CodecBase):
+    name = "brotli"
+    cid = 3
+
+    def compress(self, buf, zdict=None):
+        return brotli.compress(buf)
+
+    def decompress(self, buf, zdict=None):
+        return brotli.decompress(buf)
+
+    def compressobj(self, zdict=None):
+        comp = brotli.Compressor()
+        return _Incremental(comp.process, comp.finish)
+
+    def decompressobj(self, zdict=None):
+        return _Incremental(brotli.Decompressor().process)
+
+
+class Lz4Codec(CodecBase):
+    name = "lz4"
+    cid = 4
+
+    def compress(self, buf, zdict=None):
+        import lz4.frame
+
+        return lz4.frame.compress(buf)
+
+    def decompress(self, buf, zdict=None):
+        import lz4.frame
+
+        return lz4.frame.decompress(buf)
+
+    def compressobj(self, zdict=None):
+        import lz4.frame
+
+        comp = lz4.frame.LZ4FrameCompressor()
+        return _Incremental(comp.compress, comp.flush, prefix=comp.begin())
+
+    def decompressobj(self, zdict=None):
+        import lz4.frame
+
+        return _Incremental(lz4.frame.LZ4FrameDecompressor().decompress)
+
+
+class _Incremental:
+    def __init__(
+        self, process: Callable[[bytes], bytes], finish=None, prefix: bytes = b""
+    ):
+        self._process = process
+        self._finish = finish
+        self._prefix = prefix
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._pop_prefix() + self._process(chunk)
+
+    decompress = compress
+
+    def flush(self) -> bytes:
+        return self._pop_prefix() + (self._finish() if self._finish else b"")
+
+    def _pop_prefix(self):
+        prefix, self._prefix = self._prefix, b""
+        return prefix
+
+
+CODECS: dict[str, CodecBase] = {
+    c.name: c() for c in [NoCodec, DeflateCodec, ZstdCodec, BrotliCodec, Lz4Codec]
+}
+DELTA_CODEC = DeltaCodec()
+_CODECS_BY_ID = {c.cid: c for c in [*CODECS.values(), DELTA_CODEC]}
+
+
+def encode_header(codec: CodecBase, dict_id: str = "") -> bytes:
+    dict_buf = dict_id.encode("ascii")
+    return _MAGIC + _HEAD.pack(codec.cid, len(dict_buf)) + dict_buf
+
+
+def read_header(fp: BinaryIO) -> Optional[tuple[CodecBase, str]]:
+    """reads the header from a stream, None if it holds a zip
+
+    for a zip, the stream is left at its start
+    """
+    head = fp.read(len(_MAGIC) + _HEAD.size)
+    if is_zip(head):
+        fp.seek(-len(head), 1)
+        return None
+    codec, dict_len = _parse_head(head)
+    return codec, fp.read(dict_len).decode("ascii")
+
+
+def decode_header(payload: bytes) -> tuple[CodecBase, str, int]:
+    """returns the codec, the dictionary id and the start of the data"""
+    codec, dict_len = _parse_head(payload)
+    start = len(_MAGIC) + _HEAD.size
+    dict_id = payload[start : start + dict_len].decode("ascii")
+    return codec, dict_id, start + dict_len
+
+
+def is_zip(payload: bytes) -> bool:
+    return payload.startswith(ZIP_MAGIC)
+
+
+def _parse_head(payload: bytes) -> tuple[CodecBase, int]:
+    if not payload.startswith(_MAGIC):
+        raise ValueError("payload has no codec header")
+    cid, dict_len = _HEAD.unpack_from(payload, len(_MAGIC))
+    return _CODECS_BY_ID[cid], dict_len
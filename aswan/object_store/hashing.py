@@ -0,0 +1,37 @@
+import hashlib
+from functools import partial
+from typing import Callable
+
+# separates the tag of the hash function from the digest in object names
+HASH_SEP = "_"
+DEFAULT_HASH = "sha3"
+
+
+def _xxh3(buf: bytes = b""):
+    import xxhash
+
+    return xxhash.xxh3_128(buf)
+
+
+# name -> (hash function, tag in object names)
+# sha3 names are untagged, as they were before there were options
+HASHES: dict[str, tuple[Callable, str]] = {
+    DEFAULT_HASH: (hashlib.sha3_512, ""),
+    "blake2b": (partial(hashlib.blake2b, digest_size=20), "b2"),
+    "xxh3": (_xxh3, "x3"),
+}
+
+
+def get_hash(hash_fun) -> tuple[Callable, str]:
+    """returns the hash function and its name tag for a name or a function"""
+    if isinstance(hash_fun, str):
+        return HASHES[hash_fun]
+    return hash_fun, ""
+
+
+def tag_digest(tag: str, digest: str) -> str:
+    return f"{tag}{HASH_SEP}{digest}" if tag else digest
+
+
+def strip_tag(name: str) -> str:
+    return name.split(HASH_SEP)[-1]
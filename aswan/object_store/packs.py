@@ -0,0 +1,225 @@
+import os
+import struct
+from pathlib import Path
+from shutil import copyfileobj
+from threading import Lock
+from typing import BinaryIO, Callable, Container, Iterable, Optional, Union
+from uuid import uuid4
+
+PACK_DIR = "packs"
+SEGMENT_EXT = "pack"
+INDEX_EXT = "idx"
+DEFAULT_SEGMENT_SIZE = 2**28
+_EXTS = (SEGMENT_EXT, INDEX_EXT)
+
+# offset, length, name length - followed by the utf-8 name
+_IDX_HEAD = struct.Struct("<QIH")
+
+
+class PackStore:
+    """
+    append-only segment files with a compact name -> (segment, offset, length) index
+
+    every writing process appends to its own segment,
+    so concurrent actors never write to the same file
+
+    :param root: directory of the segments and their indices
+    :param segment_size: size in bytes after which a new segment is started
+    """
+
+    def __init__(self, root, segment_size: int = DEFAULT_SEGMENT_SIZE):
+        self.root = Path(root)
+        self.segment_size = segment_size
+        self._locations: dict[str, tuple[str, int, int]] = {}
+        self._read_positions: dict[str, int] = {}
+        self._writer: Optional[_SegmentWriter] = None
+        self._lock = Lock()
+
+    def __contains__(self, name: str):
+        return name in self._locations
+
+    def __getstate__(self):
+        return {"root": self.root, "segment_size": self.segment_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def put(self, name: str, payload: bytes):
+        with self._lock:
+            writer = self._get_writer(len(payload))
+            self._locations[name] = writer.append(name, payload)
+
+    def put_file(self, name: str, path: Path):
+        with self._lock, path.open("rb") as fp:
+            writer = self._get_writer(path.stat().st_size)
+            self._locations[name] = writer.append(name, fp)
+
+    def get(self, name: str) -> bytes:
+        fp, length = self.open(name)
+        with fp:
+            return fp.read(length)
+
+    def open(self, name: str) -> tuple[BinaryIO, int]:
+        """returns the segment file positioned at the start of the record
+        and the length of the record"""
+        segment, offset, length = self.locate(name)
+        fp = self._path(segment, SEGMENT_EXT).open("rb")
+        fp.seek(offset)
+        return fp, length
+
+    def locate(self, name: str) -> tuple[str, int, int]:
+        if name not in self._locations:
+            self.refresh()
+        if name not in self._locations:
+            raise FileNotFoundError(f"{name} is not in the packs at {self.root}")
+        return self._locations[name]
+
+    def names(self) -> Iterable[str]:
+        self.refresh()
+        return [*self._locations.keys()]
+
+    def refresh(self):
+        if not self.root.exists():
+            return
+        for idx_path in self.root.glob(f"*.{INDEX_EXT}"):
+            segment = idx_path.stem
+            start = self._read_positions.get(segment, 0)
+            with idx_path.open("rb") as fp:
+                fp.seek(start)
+                buf = fp.read()
+            consumed = 0
+            for name, offset, length, consumed in _parse_index(buf):
+                self._locations[name] = (segment, offset, length)
+            self._read_positions[segment] = start + consumed
+
+    def compact(
+        self,
+        live: Container[str],
+        on_drop: Optional[Callable[[str, bytes], None]] = None,
+    ) -> int:
+        """rewrites the segments without the records that are not live
+
+        duplicate records of a name are dropped as well.
+        assumes no other process writes to the packs meanwhile
+
+        :param on_drop: called with the name and payload of each dropped object
+        :return: the number of bytes reclaimed
+        """
+        self.close()
+        self.refresh()
+        reclaimed = 0
+        for idx_path in sorted(self.root.glob(f"*.{INDEX_EXT}")):
+            segment = idx_path.stem
+            all_records = [rec[:3] for rec in _parse_index(idx_path.read_bytes())]
+            # the location of duplicates points to an other record
+            records = [
+                (name, offset, length)
+                for name, offset, length in all_records
+                if self._locations.get(name) == (segment, offset, length)
+            ]
+            kept = [rec for rec in records if rec[0] in live]
+            if len(kept) == len(all_records):
+                continue
+            seg_path = self._path(segment, SEGMENT_EXT)
+            reclaimed += _size(seg_path, idx_path)
+            writer = _SegmentWriter(self.root) if kept else None
+            with seg_path.open("rb") as fp:
+                for name, offset, length in records:
+                    if name not in live:
+                        del self._locations[name]
+                        if on_drop is None:
+                            continue
+                    fp.seek(offset)
+                    payload = fp.read(length)
+                    if name in live:
+                        self._locations[name] = writer.append(name, payload)
+                    else:
+                        on_drop(name, payload)
+            seg_path.unlink()
+            idx_path.unlink()
+            self._read_positions.pop(segment)
+            if writer is not None:
+                writer.close()
+                new_paths = [self._path(writer.segment, ext) for ext in _EXTS]
+                reclaimed -= _size(*new_paths)
+                self._read_positions[writer.segment] = new_paths[1].stat().st_size
+        return reclaimed
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+            self._writer = None
+
+    def purge(self):
+        self.close()
+        if not self.root.exists():
+            return
+        for p in self.root.iterdir():
+            p.unlink()
+        self.root.rmdir()
+        self._locations = {}
+        self._read_positions = {}
+
+    def _get_writer(self, next_size: int) -> "_SegmentWriter":
+        writer = self._writer
+        if (writer is not None) and (writer.pid != os.getpid()):
+            # forked, the segment belongs to the parent
+            writer = None
+        elif (writer is not None) and writer.size + next_size > self.segment_size:
+            writer.close()
+            writer = None
+        if writer is None:
+            self.root.mkdir(exist_ok=True, parents=True)
+            writer = self._writer = _SegmentWriter(self.root)
+        return writer
+
+    def _path(self, segment: str, ext: str) -> Path:
+        return self.root / f"{segment}.{ext}"
+
+
+class _SegmentWriter:
+    def __init__(self, root: Path):
+        self.segment = uuid4().hex
+        self.pid = os.getpid()
+        self.size = 0
+        self._data = (root / f"{self.segment}.{SEGMENT_EXT}").open("ab")
+        self._index = (root / f"{self.segment}.{INDEX_EXT}").open("ab")
+
+    def append(
+        self, name: str, payload: Union[bytes, BinaryIO]
+    ) -> tuple[str, int, int]:
+        offset = self.size
+        if isinstance(payload, bytes):
+            self._data.write(payload)
+        else:
+            copyfileobj(payload, self._data)
+        # data is flushed first, so an indexed record is always complete
+        self._data.flush()
+        length = self._data.tell() - offset
+        name_buf = name.encode("utf-8")
+        self._index.write(_IDX_HEAD.pack(offset, length, len(name_buf)))
+        self._index.write(name_buf)
+        self._index.flush()
+        self.size += length
+        return self.segment, offset, length
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+
+def _size(*paths: Path) -> int:
+    return sum(p.stat().st_size for p in paths)
+
+
+def _parse_index(buf: bytes):
+    pos = 0
+    while pos + _IDX_HEAD.size <= len(buf):
+        offset, length, name_len = _IDX_HEAD.unpack_from(buf, pos)
+        end = pos + _IDX_HEAD.size + name_len
+        if end > len(buf):
+            # partially written record
+            return
+        yield buf[pos + _IDX_HEAD.size : end].decode("utf-8"), offset, length, end
+        pos = end
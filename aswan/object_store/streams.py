@@ -0,0 +1,150 @@
+import io
+import zipfile
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterator, Optional
+
+from .codecs import ZIP_CODEC, ZIP_ENTRY, CodecBase, encode_header, read_header
+
+if TYPE_CHECKING:
+    from .base import ObjectStore  # pragma: no cover
+
+TMP_DIR = "tmp"
+CHUNK_SIZE = 2**16
+
+
+class StoredObject(str):
+    """name of an object that is already in the store
+
+    dumping it only returns the name
+    """
+
+
+class ObjectWriter:
+    """
+    writable stream into the object store,
+    hashing and compressing the object as it is written
+
+    the object is stored when the stream is closed,
+    and its name is set as `name`
+    """
+
+    def __init__(self, store: "ObjectStore", ext: str, dict_key=None):
+        self.name: Optional[str] = None
+        self._store = store
+        self._ext = ext
+        self._hash = store.hash_fun()
+        tmp_dir = store.root_path / TMP_DIR
+        tmp_dir.mkdir(exist_ok=True, parents=True)
+        self._tmp = NamedTemporaryFile(dir=tmp_dir, delete=False)
+        self._zip = None
+        if (store.codec == ZIP_CODEC) and (not store.packed):
+            zip_ctx = zipfile.ZipFile(self._tmp, "w", compression=store._comp)
+            self._zip = zip_ctx, zip_ctx.open(ZIP_ENTRY, "w", force_zip64=True)
+        else:
+            codec, dict_id, zdict = store._get_codec(dict_key)
+            self._tmp.write(encode_header(codec, dict_id))
+            self._comp = codec.compressobj(zdict)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, chunk: bytes) -> int:
+        self._hash.update(chunk)
+        if self._zip is not None:
+            self._zip[1].write(chunk)
+        else:
+            self._tmp.write(self._comp.compress(chunk))
+        return len(chunk)
+
+    def close(self) -> str:
+        if self.name is None:
+            self._close_tmp()
+            name = self._store._get_name(self._hash.hexdigest(), self._ext)
+            self._store._store_file(Path(self._tmp.name), name)
+            self.name = StoredObject(name)
+        return self.name
+
+    def abort(self):
+        self._close_tmp()
+        Path(self._tmp.name).unlink(missing_ok=True)
+
+    def _close_tmp(self):
+        if self._zip is not None:
+            for closeable in reversed(self._zip):
+                closeable.close()
+        elif not self._tmp.closed:
+            self._tmp.write(self._comp.flush())
+        self._tmp.close()
+
+
+def open_decoded(
+    fp: BinaryIO,
+    length: Optional[int],
+    get_zdict: Callable[[CodecBase, str], Optional[bytes]],
+) -> BinaryIO:
+    """readable stream of the decoded object starting at the position of fp
+
+    length limits the bytes read from fp, if the object is not the whole file
+    """
+    start = fp.tell()
+    header = read_header(fp)
+    if header is None:
+        zip_ctx = zipfile.ZipFile(fp)
+        content = zip_ctx.open(ZIP_ENTRY)
+        chunks = iter(lambda: content.read(CHUNK_SIZE), b"")
+        raw = _DecodedReader(chunks, CodecBase().decompressobj(), [zip_ctx, fp])
+    else:
+        codec, dict_id = header
+        if length is not None:
+            length -= fp.tell() - start
+        decomp = codec.decompressobj(get_zdict(codec, dict_id))
+        raw = _DecodedReader(_iter_chunks(fp, length), decomp, [fp])
+    return io.BufferedReader(raw, CHUNK_SIZE)
+
+
+class _DecodedReader(io.RawIOBase):
+    def __init__(self, chunks: Iterator[bytes], decompressor, closeables: list):
+        self._chunks = chunks
+        self._decomp = decompressor
+        self._closeables = closeables
+        self._buf = b""
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        while (not self._buf) and (not self._done):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._buf = self._decomp.flush()
+                self._done = True
+            else:
+                self._buf = self._decomp.decompress(chunk)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            for closeable in self._closeables:
+                closeable.close()
+        super().close()
+
+
+def _iter_chunks(fp: BinaryIO, length: Optional[int]) -> Iterator[bytes]:
+    while (length is None) or (length > 0):
+        chunk = fp.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+        if not chunk:
+            return
+        if length is not None:
+            length -= len(chunk)
+        yield chunk
@@ -8,7 +8,8 @@ from structlog import get_logger
 from . import url_handler as urh
 from .connection_session import HandlingTask, get_actor_items
 from .constants import Statuses
-from .depot import AswanDepot, Status
+from .depot import AswanDepot, DepotConfig, Status
+from .depot.event_writer import EventWriter
 from .models import RegEvent, SourceUrl
 from .resources import REnum
 from .utils import is_subclass, run_and_log_functions
@@ -28,8 +29,9 @@ class Project:
         max_cpu_use: float = float(cpu_count()),
         batch_multiplier=16,
         debug=False,
+        depot_config: Optional[DepotConfig] = None,
     ):
-        self.depot = AswanDepot(name, local_root)
+        self.depot = AswanDepot(name, local_root, depot_config)
         self.distributed_api = distributed_api
         self.debug = debug
         self.max_displays = max_displays
@@ -39,6 +41,7 @@ class Project:
 
         self._handler_dic: Dict[str, urh.ANY_HANDLER_T] = {}
         self._scheduler: Optional[Scheduler] = None
+        self._event_writer: Optional[EventWriter] = None
         self._monitor_app_process: Optional[Process] = None
 
         self._ran_once = False
@@ -133,15 +136,22 @@ class Project:
         _old_da = self.distributed_api
         if force_sync:
             self.distributed_api = DEFAULT_DIST_API_KEY
-        run_and_log_functions([*extra_prep, self._create_scheduler], batch="prep")
-        for res in self._scheduler.process(
-            batch_producer=self._get_next_batch, min_queue_size=self.min_queue_size
-        ):
-            if isinstance(res, Exception):
-                raise res
-
-        run_and_log_functions([self._scheduler.join], batch="cleanup")
-        self.distributed_api = _old_da
+        try:
+            run_and_log_functions([*extra_prep, self._create_scheduler], batch="prep")
+            for res in self._scheduler.process(
+                batch_producer=self._get_next_batch,
+                min_queue_size=self.min_queue_size,
+            ):
+                if isinstance(res, Exception):
+                    raise res
+
+            run_and_log_functions([self._scheduler.join], batch="cleanup")
+        finally:
+            # the queued events are integrated even if the run failed
+            if self._event_writer is not None:
+                writer, self._event_writer = self._event_writer, None
+                writer.close()
+            self.distributed_api = _old_da
 
     def _get_next_batch(self):
         if self._ran_once and not self._keep_running:
@@ -175,10 +185,15 @@ class Project:
         self.depot.current.integrate_events(reg_events)
 
     def _create_scheduler(self):
+        event_queue = None
+        if self.depot.config.single_writer:
+            self._event_writer = EventWriter(self.depot.current).start()
+            event_queue = self._event_writer.queue
+        actor_items = get_actor_items(
+            self._handler_dic.values(), self.depot.root, event_queue
+        )
         self._scheduler = Scheduler(
-            actor_dict=dict(
-                get_actor_items(self._handler_dic.values(), depot_path=self.depot.root)
-            ),
+            actor_dict=dict(actor_items),
             resource_limits=self.resource_limits,
             distributed_system=self.distributed_api,
             verbose=self.debug,
@@ -1,15 +1,22 @@
+import time
+
 from bs4 import BeautifulSoup
+from sqlalchemy.orm import Session
 
 import aswan.tests.godel_src.handlers as ghandlers
 from aswan import (
     AswanDepot,
     BrokenSessionError,
     BrowserSoupHandler,
+    DepotConfig,
     RequestJsonHandler,
     RequestSoupHandler,
+    RequestStreamHandler,
     Statuses,
 )
 from aswan.connection_session import ConnectionSession, HandlingTask
+from aswan.metadata_handling import get_lease_owner
+from aswan.models import RegEvent, SourceUrl
 from aswan.tests.godel_src.app import test_app_default_address
 
 _URL = f"{test_app_default_address}/test_page/Axiom.html"
@@ -100,3 +107,49 @@ def test_url_params(godel_test_app):
         params={"param": r'{"s":10}'},
     )
     assert out == {"s": 10}
+
+
+def test_write_behind(tmp_path, godel_test_app):
+    class H(RequestSoupHandler):
+        def parse(self, soup: "BeautifulSoup"):
+            return {"url": self._url}
+
+    AswanDepot("depot", tmp_path, DepotConfig(write_behind=4)).setup()
+    setup = _Setup(tmp_path, H)
+    for _ in range(3):
+        setup.run()
+    # written when consume returns, as actors are killed without stopping them
+    uhr = setup.get_res()
+    assert uhr.status == Statuses.PROCESSED
+    assert uhr.content == {"url": _URL}
+
+
+def test_lease_start(tmp_path, godel_test_app):
+    leases = []
+
+    class H(RequestSoupHandler):
+        def parse(self, soup: "BeautifulSoup"):
+            with Session(current.engine) as session:
+                surl = session.query(SourceUrl).one()
+                leases.append((surl.lease_owner, surl.lease_expires))
+            return {}
+
+    current = AswanDepot("depot", tmp_path).setup().current.setup()
+    current.integrate_events([RegEvent(_URL, "H")])
+    current.next_batch(1, lease_owner="scheduler")
+    _Setup(tmp_path, H).run()
+    [(owner, expires)] = leases
+    assert owner == get_lease_owner()
+    assert expires > time.time()
+
+
+def test_stream_handler(tmp_path, godel_test_app):
+    class H(RequestStreamHandler):
+        chunk_size = 100
+
+    setup = _Setup(tmp_path, H)
+    setup.run()
+    setup.cm.stop()
+    uhr = setup.get_res()
+    assert uhr.status == Statuses.PROCESSED
+    assert uhr.content == b"Axiom has no title"
@@ -1,14 +1,27 @@
 import os
+import pickle
+import time
+import zipfile
 from functools import partial
+from itertools import islice
 from pathlib import Path
 from shutil import rmtree
 
+import pytest
 from atqo import parallel_map
 
 import aswan
 from aswan.constants import Statuses
+from aswan.depot import base, run_index, url_dedup
 from aswan.depot.base import CONTEXT_YAML, Run
-from aswan.models import CollEvent
+from aswan.depot.block_archive import BlockArchive, write_block_archive
+from aswan.depot.catalog import EventCatalog
+from aswan.depot.event_log import EventLog, iter_records, write_record
+from aswan.depot.event_writer import EventWriter, LeaseStart
+from aswan.depot.latest_index import LatestIndex
+from aswan.depot.url_dedup import UrlDedup
+from aswan.models import CollEvent, RegEvent
+from aswan.object_store import ObjectStore
 
 from .test_metadata_handling import get_cev
 
@@ -109,3 +122,509 @@ def test_depot_restatus(test_depot: aswan.AswanDepot):
     assert len(new_comp.integrated_runs) == 1
     still_comp = test_depot.get_complete_status()
     assert still_comp.name == new_comp.name
+
+
+def test_depot_config(tmp_path):
+    conf = aswan.DepotConfig(packed_objects=True)
+    depot = aswan.AswanDepot("conf", tmp_path, conf).setup(True)
+    _of = depot.object_store.dump_bytes(b"XYZ")
+    depot.current.integrate_events([get_cev(output_file=_of)])
+    depot.save_current()
+
+    depot2 = aswan.AswanDepot("conf", tmp_path)
+    assert depot2.config == conf
+    assert depot2.object_store.packed
+    assert next(depot2.get_handler_events()).content == b"XYZ"
+
+
+def test_train_dictionary(tmp_path):
+    conf = aswan.DepotConfig(object_codec="zstd")
+    depot = aswan.AswanDepot("dict", tmp_path, conf).setup(True)
+    cevs = [
+        get_cev(url=f"u{i}", output_file=depot.object_store.dump(f"<p>{i}</p>" * 9))
+        for i in range(200)
+    ]
+    depot.current.integrate_events(cevs)
+    depot.save_current()
+    dict_id = depot.train_dictionary("A", dict_size=1024)
+    assert depot.object_store._get_dict_id("A") == dict_id
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_gc_objects(tmp_path, packed):
+    conf = aswan.DepotConfig(packed_objects=packed)
+    depot = aswan.AswanDepot("gc", tmp_path, conf).setup(True)
+    objs = [f"obj-{i}" * 100 for i in range(6)]
+    names = [*map(depot.object_store.dump, objs)]
+    for i in range(3):
+        depot.current.integrate_events([get_cev(url=f"u{i}", output_file=names[i])])
+        if i < 2:
+            depot.save_current()
+            depot.current.purge()
+            depot.init_w_complete()
+
+    assert depot.gc_objects(workers=2, archive=tmp_path / "archive") > 0
+    assert depot.gc_objects() == 0
+    fresh = aswan.AswanDepot("gc", tmp_path).object_store
+    assert [*map(fresh.read, names[:3])] == objs[:3]
+    archived = ObjectStore(tmp_path / "archive")
+    assert [*map(archived.read, names[3:])] == objs[3:]
+    with pytest.raises(FileNotFoundError):
+        fresh.read(names[3])
+
+
+def test_event_log(tmp_path):
+    log = EventLog(tmp_path / "log", segment_size=100, sync_every=3)
+    log.append([(f"r-{i}", b"x" * i) for i in range(30)])
+    assert len(log.segments()) == 1
+    log.append([("r-last", b"")])
+    log.append([("r-next", b"y")])
+    assert len(log.segments()) == 2
+    # a killed writer might leave a partial record
+    with log.segments()[0].open("ab") as fp:
+        fp.write(b"\x05\x00")
+    names = [name for _, name, _, _ in log.iter_records()]
+    assert sorted(names) == sorted([*[f"r-{i}" for i in range(30)], "r-last", "r-next"])
+
+
+def test_binary_events(tmp_path):
+    config = aswan.DepotConfig(binary_events=True)
+    depot = aswan.AswanDepot("bin-test", tmp_path, config=config).setup(True)
+    depot.current.integrate_events([get_cev(url=f"l{i}") for i in range(3)])
+    depot.save_current()
+    cevs = [pcev.cev for pcev in depot.get_handler_events("A")]
+    assert sorted(cev.url for cev in cevs) == ["l0", "l1", "l2"]
+
+
+def test_legacy_db(test_depot: aswan.AswanDepot):
+    current = test_depot.current
+    with current.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE source_urls")
+        conn.exec_driver_sql("DROP TABLE surl_counts")
+        conn.exec_driver_sql(
+            "CREATE TABLE source_urls (cid INTEGER PRIMARY KEY, url VARCHAR,"
+            " handler VARCHAR, current_status VARCHAR, UNIQUE (url, handler))"
+        )
+        conn.exec_driver_sql("INSERT INTO source_urls VALUES (1, 'l1', 'A', 'todo')")
+    current.integrate_events([get_cev(url="l0")])
+    status = test_depot.save_current()
+    current.purge()
+    test_depot.set_as_current(status)
+    current.integrate_events([RegEvent("l2", "A", priority=3)])
+    batch = current.next_batch(5, parser=lambda b: [(s.url, s.priority) for s in b])
+    assert batch == [("l2", 3), ("l1", 0)]
+    assert current.any_in_progress()
+
+
+def test_legacy_events(test_depot: aswan.AswanDepot):
+    old_cev = get_cev(output_file="of-old")
+    old_cev.dump(test_depot.current.events)
+    test_depot.current.integrate_events([get_cev(url="link-2", output_file="of-new")])
+    assert not [*test_depot.current.events.iterdir()][1:]
+    test_depot.save_current()
+    run_name = [*test_depot.get_all_run_ids()][0]
+    run_dir = test_depot.runs_path / run_name
+    assert (run_dir / "events.log").exists()
+    assert not (run_dir / "events.zip").exists()
+
+    legacy_run = test_depot.runs_path / f"{time.time()}-legacy"
+    legacy_run.mkdir()
+    with zipfile.ZipFile(legacy_run / "events.zip", "w") as zfp:
+        zfp.writestr(*get_cev(url="link-3", output_file="of-zip").to_record())
+    ofs = [pcev.cev.output_file for pcev in test_depot.get_handler_events()]
+    assert sorted(ofs) == ["of-new", "of-old", "of-zip"]
+
+
+@pytest.mark.parametrize("arrow", [True, False])
+def test_run_index(test_depot: aswan.AswanDepot, monkeypatch, arrow):
+    if not arrow:
+        _import = run_index._import
+        monkeypatch.setattr(
+            run_index, "_import", lambda m: None if "arrow" in m else _import(m)
+        )
+    statuses = [Statuses.PROCESSED, Statuses.PARSING_ERROR]
+    test_depot.current.integrate_events(
+        get_cev(
+            url=f"u{i % 7}",
+            handler="AB"[i % 2],
+            status=statuses[i % 3 == 0],
+            timestamp=i,
+            output_file=f"of{i}",
+        )
+        for i in range(40)
+    )
+    test_depot.save_current()
+    index_file = run_index.INDEX_PARQUET if arrow else run_index.INDEX_NPZ
+    index_path = test_depot.runs_path / [*test_depot.get_all_run_ids()][0] / index_file
+
+    def _get(**kwargs):
+        return [
+            pcev.cev.output_file for pcev in test_depot.get_handler_events(**kwargs)
+        ]
+
+    kwarg_sets = [
+        {},
+        {"handler": "A"},
+        {"only_successful": False, "only_latest": False},
+    ]
+    indexed = [*map(lambda kw: _get(**kw), kwarg_sets)]
+    index_path.unlink()
+    assert indexed == [*map(lambda kw: _get(**kw), kwarg_sets)]
+    assert indexed[0] == ["of38", "of37", "of35", "of34", "of32", "of29", "of26"]
+
+
+def test_archive_pool(test_depot: aswan.AswanDepot):
+    test_depot.current.integrate_events([get_cev(output_file="of-log")])
+    test_depot.save_current()
+    zip_run = test_depot.runs_path / f"{time.time()}-legacy"
+    zip_run.mkdir()
+    with zipfile.ZipFile(zip_run / "events.zip", "w") as zfp:
+        for i in range(3):
+            zfp.writestr(*get_cev(url=f"u{i}", output_file=f"of-{i}").to_record())
+    test_depot.archive_pool.max_open = 1
+    lazy_events = [
+        ev
+        for run_name in test_depot.get_all_run_ids()
+        for ev in test_depot._get_run_events(run_name, extend=False)
+    ]
+    assert not lazy_events[0]._extended
+    copies = pickle.loads(pickle.dumps(lazy_events))
+    ofs = sorted(ev.extend().output_file for ev in [*lazy_events, *copies])
+    assert ofs == sorted(["of-log", "of-0", "of-1", "of-2"] * 2)
+    assert len(test_depot.archive_pool._handles) == 1
+
+
+def test_parallel_scan(test_depot: aswan.AswanDepot):
+    for run in range(4):
+        test_depot.current.integrate_events(
+            get_cev(
+                url=f"u{i % 5}",
+                handler="AB"[i % 2],
+                timestamp=run * 10 + i,
+                output_file=f"of-{run}-{i}",
+            )
+            for i in range(8)
+        )
+        test_depot.save_current()
+        test_depot.current.purge()
+        test_depot.init_w_complete()
+    for kwargs in [{}, {"handler": "B"}, {"only_latest": False}, {"past_runs": 2}]:
+        serial = [*test_depot.get_handler_events(**kwargs)]
+        parallel = [*test_depot.get_handler_events(workers=2, **kwargs)]
+        assert [p.cev.output_file for p in serial] == [
+            p.cev.output_file for p in parallel
+        ]
+
+
+def test_latest_index(test_depot: aswan.AswanDepot):
+    zip_run = test_depot.runs_path / f"{time.time() - 100}-legacy"
+    zip_run.mkdir()
+    with zipfile.ZipFile(zip_run / "events.zip", "w") as zfp:
+        for i in range(3):
+            zfp.writestr(
+                *get_cev(
+                    url=f"u{i}", output_file=f"of-zip-{i}", timestamp=100 - i
+                ).to_record()
+            )
+
+    def _compare():
+        all_runs = test_depot.get_all_run_ids()
+        scanned = test_depot.get_handler_events("A", past_runs=all_runs)
+        looked_up = test_depot.get_handler_events("A")
+        out = [pcev.cev.output_file for pcev in looked_up]
+        assert out == [pcev.cev.output_file for pcev in scanned]
+        return out
+
+    assert _compare() == ["of-zip-0", "of-zip-1", "of-zip-2"]
+    test_depot.current.integrate_events(
+        [
+            get_cev(url="u1", output_file="of-new-1"),
+            get_cev(url="u1", output_file="of-old", timestamp=10),
+            get_cev(url="u2", output_file="of-err", status=Statuses.PARSING_ERROR),
+            get_cev(url="u3", handler="B", output_file="of-b"),
+        ]
+    )
+    test_depot.save_current()
+    assert test_depot.latest_index.missing_runs(test_depot.get_all_run_ids()) == set()
+    assert _compare() == ["of-new-1", "of-zip-0", "of-zip-2"]
+
+    # a removed run is dropped from the index, in this and in a new process
+    for run_name in test_depot.get_all_run_ids() - {zip_run.name}:
+        rmtree(test_depot.runs_path / run_name)
+    reopened = aswan.AswanDepot(test_depot.name, test_depot.root.parent)
+    assert [p.cev.output_file for p in reopened.get_handler_events("A")] == [
+        "of-zip-0",
+        "of-zip-1",
+        "of-zip-2",
+    ]
+    assert _compare() == ["of-zip-0", "of-zip-1", "of-zip-2"]
+
+
+def test_concurrent_latest_index(tmp_path):
+    row = dict(handler="A", url_hash=2**63 + 5, timestamp=1, name="n", offset=0)
+    indices = [LatestIndex(tmp_path / "latest.sqlite") for _ in range(2)]
+    # both processes see the run missing, before any of them adds it
+    assert [index.missing_runs(["r1"]) for index in indices] == [{"r1"}] * 2
+    for index in indices:
+        index.add_run("r1", 1.0, [row | {"length": 1}])
+    assert indices[0].lookup("A") == [("r1", "n", 0, 1)]
+
+
+def test_event_writer_order(test_depot: aswan.AswanDepot):
+    current = test_depot.current.setup()
+    current.integrate_events([RegEvent(url="u1", handler="A")])
+    current.next_batch(1)
+    writer = EventWriter(current)
+    writer.queue.put(LeaseStart("A", "u1", "actor"))
+    # the url is registered again, and processed after that, in one batch
+    writer.queue.put([RegEvent(url="u1", handler="A", overwrite=True)])
+    writer.queue.put([get_cev(url="u1")])
+    writer.start().close()
+    assert current.next_batch(5, to_processing=False) == []
+    logged = [type(ev.extend()) for ev in current.iter_events()]
+    assert logged == [RegEvent, RegEvent, CollEvent]
+
+
+def test_merged_runs(test_depot: aswan.AswanDepot):
+    for run in range(3):
+        # overlapping runs, as from parallel machines
+        test_depot.current.integrate_events(
+            [
+                *[get_cev(url=f"u{i}", timestamp=i * 3 + run) for i in range(4)],
+                RegEvent(url="r", handler="A"),
+            ]
+        )
+        test_depot.save_current()
+        test_depot.current.purge()
+        test_depot.init_w_complete()
+    run_dirs = [test_depot.runs_path / r for r in test_depot.get_all_run_ids()]
+    for run_dir in run_dirs:
+        names = [name for name, _, _ in iter_records(run_dir / "events.log")]
+        assert [n[0] for n in names] == ["c"] * 4 + ["r"]
+        assert Run.read(run_dir).sorted_events
+
+    def _timestamps():
+        pcevs = test_depot.get_handler_events(only_latest=False)
+        return [pcev.cev.timestamp for pcev in pcevs]
+
+    expected = sorted(range(12), reverse=True)
+    assert _timestamps() == expected
+    # unindexed runs are streamed
+    for run_dir in run_dirs:
+        for index_file in run_index.INDEX_FILES:
+            (run_dir / index_file).unlink(missing_ok=True)
+    assert _timestamps() == expected
+    assert [p.cev.url for p in test_depot.get_handler_events()] == [
+        "u3",
+        "u2",
+        "u1",
+        "u0",
+    ]
+
+
+def test_lazy_runs(test_depot: aswan.AswanDepot, monkeypatch):
+    # the first run has the newest events
+    for run in [10, 1, 2, 3]:
+        test_depot.current.integrate_events(
+            [get_cev(url=f"u{run}-{i}", timestamp=run * 100 + i) for i in range(3)]
+        )
+        test_depot.save_current()
+        test_depot.current.purge()
+        test_depot.init_w_complete()
+        time.sleep(0.01)
+
+    expected = [r * 100 + i for r in [10, 3, 2, 1] for i in [2, 1, 0]]
+    for workers in [None, 2]:
+        pcevs = test_depot.get_handler_events(only_latest=False, workers=workers)
+        assert [p.cev.timestamp for p in pcevs] == expected
+
+    opened = []
+    _iter_events = base._iter_matching_events
+
+    def _record_open(*args):
+        opened.append(args[-1])
+        return _iter_events(*args)
+
+    monkeypatch.setattr(base, "_iter_matching_events", _record_open)
+    pcevs = test_depot.get_handler_events(only_latest=False)
+    assert next(pcevs).cev.timestamp == 1002
+    assert len(opened) == 1
+    assert [p.cev.timestamp for p in islice(pcevs, 3)] == [1001, 1000, 302]
+    assert len(opened) == 2
+
+
+def test_run_stats(test_depot: aswan.AswanDepot, monkeypatch):
+    for run in [1, 2]:
+        test_depot.current.integrate_events(
+            [get_cev(url=f"u{run}-{i}", timestamp=run * 100 + i) for i in range(3)]
+        )
+        test_depot.save_current()
+        test_depot.current.purge()
+        test_depot.init_w_complete()
+        time.sleep(0.01)
+
+    def _get_timestamps():
+        pcevs = test_depot.get_handler_events(only_latest=False, since=200)
+        return [p.cev.timestamp for p in pcevs]
+
+    with monkeypatch.context() as m:
+        # scans need no run context
+        m.setattr(Run, "read", None)
+        assert _get_timestamps() == [202, 201, 200]
+    # runs saved by older versions only have their context
+    for run_name in test_depot.get_all_run_ids():
+        (test_depot.runs_path / run_name / base.RUN_STATS_JSON).unlink()
+    assert _get_timestamps() == [202, 201, 200]
+
+
+@pytest.mark.parametrize("spill", [False, True])
+@pytest.mark.parametrize("numpy", [False, True])
+def test_url_dedup(tmp_path, monkeypatch, spill, numpy):
+    if not numpy:
+        monkeypatch.setattr(url_dedup, "_import", lambda _: None)
+    dedup = UrlDedup(buffer_size=4, spill_dir=tmp_path / "spill" if spill else None)
+    hashes = [run_index.hash_url(f"u{i}") for i in range(50)] + [2**64 - 1, 0]
+    assert all(map(dedup.add, hashes))
+    assert not any(map(dedup.add, hashes[::-1]))
+    assert len(dedup) == len(hashes)
+    assert run_index.hash_url("other") not in dedup
+    if numpy:
+        assert len(dedup._levels) <= 4
+    if numpy and spill:
+        assert len([*(tmp_path / "spill").glob("*/*.npy")]) == len(dedup._levels)
+    dedup.close()
+    assert not [*tmp_path.glob("spill/*")]
+
+
+def test_partitioned_runs(tmp_path):
+    config = aswan.DepotConfig(partition_runs=True)
+    depot = aswan.AswanDepot("part-test", tmp_path, config=config).setup(True)
+    depot.current.integrate_events(
+        [
+            *[get_cev(url=f"u{i}", handler="AB"[i % 2], timestamp=i) for i in range(6)],
+            RegEvent(url="r", handler="C"),
+        ]
+    )
+    depot.save_current()
+    run_dir = depot.runs_path / next(iter(depot.get_all_run_ids()))
+    parts_dir = run_dir / "handlers"
+    assert sorted(p.name for p in parts_dir.iterdir()) == ["A", "B", "C"]
+    assert not (run_dir / "events.log").exists()
+
+    def _urls(**kwargs):
+        return [pcev.url for pcev in depot.get_handler_events(**kwargs)]
+
+    assert _urls(handler="A") == ["u4", "u2", "u0"]
+    assert _urls(handler="B", past_runs=1) == ["u5", "u3", "u1"]
+    assert _urls() == [f"u{i}" for i in range(5, -1, -1)]
+    rmtree(parts_dir / "B")
+    assert _urls() == ["u4", "u2", "u0"]
+    assert _urls(handler="B", past_runs=1) == []
+
+
+def test_time_range(test_depot: aswan.AswanDepot, monkeypatch):
+    for run in range(3):
+        test_depot.current.integrate_events(
+            get_cev(url=f"u{run}-{i}", handler="AB"[run % 2], timestamp=run * 100 + i)
+            for i in range(5)
+        )
+        test_depot.save_current()
+        test_depot.current.purge()
+        test_depot.init_w_complete()
+    run_ctxs = [
+        Run.read(test_depot.runs_path / r) for r in test_depot.get_all_run_ids()
+    ]
+    assert sorted(ctx.min_timestamp for ctx in run_ctxs) == [0, 100, 200]
+    assert sorted(ctx.max_timestamp for ctx in run_ctxs) == [4, 104, 204]
+    assert {"A": 5} in [ctx.handler_counts for ctx in run_ctxs]
+
+    opened = []
+    _read_index = base.read_index
+    monkeypatch.setattr(
+        base, "read_index", lambda d: opened.append(d) or _read_index(d)
+    )
+
+    def _timestamps(**kwargs):
+        opened.clear()
+        return [p.cev.timestamp for p in test_depot.get_handler_events(**kwargs)]
+
+    assert _timestamps(since=103, until=201) == [200, 104, 103]
+    assert len(opened) == 2
+    assert _timestamps(handler="A", since=3) == [204, 203, 202, 201, 200, 4, 3]
+    assert len(opened) == 2
+    assert _timestamps(handler="B", until=100) == []
+    assert not opened
+
+
+def test_block_archive(tmp_path):
+    log_path = tmp_path / "events.log"
+    with log_path.open("wb") as fp:
+        for i in range(200):
+            write_record(fp, f"r-{i}", f"blob-{i}".encode() * (i % 7))
+    blocks_path = tmp_path / "events.blocks"
+    write_block_archive(log_path, blocks_path, "zstd", block_size=100)
+    assert blocks_path.stat().st_size < log_path.stat().st_size
+    archive = BlockArchive(blocks_path)
+    records = [*iter_records(log_path)]
+    assert [*archive.iter_records()] == records
+    for _, blob, offset in records[::-1]:
+        assert archive.read(offset, len(blob)) == blob
+    archive.close()
+
+
+@pytest.mark.parametrize("codec", ["deflate", "zstd"])
+def test_compressed_runs(tmp_path, codec):
+    config = aswan.DepotConfig(run_codec=codec)
+    depot = aswan.AswanDepot("comp-test", tmp_path, config=config).setup(True)
+    depot.current.integrate_events(
+        get_cev(url=f"u{i}", timestamp=i, output_file=f"of-{i}") for i in range(50)
+    )
+    depot.save_current()
+    run_name = next(iter(depot.get_all_run_ids()))
+    run_dir = depot.runs_path / run_name
+    assert [p.name for p in run_dir.glob("events.*")] == ["events.blocks"]
+    expected = [f"of-{i}" for i in range(49, -1, -1)]
+    assert [p.cev.output_file for p in depot.get_handler_events("A")] == expected
+    for index_file in run_index.INDEX_FILES:
+        (run_dir / index_file).unlink(missing_ok=True)
+    assert [p.cev.output_file for p in depot.get_handler_events()] == expected
+    run_events = depot._get_run_events(run_name)
+    assert sorted(ev.url for ev in run_events) == sorted(f"u{i}" for i in range(50))
+
+
+def test_event_catalog(tmp_path):
+    config = aswan.DepotConfig(event_catalog=True, partition_runs=True)
+    depot = aswan.AswanDepot("cat-test", tmp_path, config=config).setup(True)
+    for run in range(2):
+        depot.current.integrate_events(
+            get_cev(
+                url=f"u{i % 3}",
+                handler="AB"[i % 2],
+                status=[Statuses.PROCESSED, Statuses.PARSING_ERROR][i % 3 == 0],
+                timestamp=run * 86400 + i,
+            )
+            for i in range(6)
+        )
+        depot.save_current()
+        depot.current.purge()
+        depot.init_w_complete()
+        assert depot.catalog.missing_archives(depot._get_archive_names()) == set()
+    error_rates = depot.query(
+        "SELECT handler, date(timestamp, 'unixepoch') AS day,"
+        " avg(status = :error) AS error_rate FROM events"
+        " GROUP BY handler, day ORDER BY handler, day",
+        error=Statuses.PARSING_ERROR,
+    )
+    assert [r["error_rate"] for r in error_rates] == [pytest.approx(1 / 3)] * 4
+    assert depot.query("SELECT count(DISTINCT url) AS n FROM events") == [{"n": 3}]
+    frame = depot.query_frame("SELECT run, count(*) AS n FROM events GROUP BY run")
+    assert frame["n"].tolist() == [6, 6]
+
+
+def test_concurrent_catalog(tmp_path):
+    row = dict(handler="A", status="s", timestamp=1, url="u", output_file="f")
+    catalogs = [EventCatalog(tmp_path / "catalog.sqlite") for _ in range(2)]
+    assert [c.missing_archives(["a1"]) for c in catalogs] == [{"a1"}] * 2
+    for catalog in catalogs:
+        catalog.add_archive("a1", "r1", [row])
+    assert catalogs[0].query("SELECT count(*) AS n FROM events") == [{"n": 1}]
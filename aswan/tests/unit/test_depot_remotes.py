@@ -1,6 +1,8 @@
 from functools import partial
 from pathlib import Path
 
+import pytest
+
 import aswan
 from aswan.depot import AswanDepot
 from aswan.depot.remote import get_remote
@@ -112,3 +114,55 @@ def test_continue(env_auth_id: str):
     depot.purge()
 
     depot.pull(post_status=half.name)
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_pull_handlers(env_auth_id: str, tmp_path: Path, packed: bool):
+    config = aswan.DepotConfig(
+        partition_runs=True, packed_objects=packed, delta_chain_length=3
+    )
+    depot = AswanDepot("partitioned", tmp_path, config=config).setup(True)
+    outputs = {}
+    for h in ["H1", "H2"]:
+        # the outputs are deltas against a base
+        depot.object_store.dump_bytes(h.encode() * 100, delta_key=h)
+        outputs[h] = depot.object_store.dump_bytes(h.encode(), delta_key=h)
+    depot.current.integrate_events(
+        [_cev(handler=h, url=f"url-{h}", output_file=of) for h, of in outputs.items()]
+    )
+    depot.save_current()
+    depot.push(env_auth_id)
+    depot.purge().setup(True)
+
+    def _get_outputs(handler):
+        return [pcev.cev.output_file for pcev in depot.get_handler_events(handler)]
+
+    depot.pull(env_auth_id, complete=True, handlers=["H1"])
+    assert _get_outputs("H1") == [outputs["H1"]]
+    assert _get_outputs("H2") == []
+    assert depot.object_store.read_bytes(outputs["H1"]) == b"H1"
+    if not packed:
+        assert not depot.object_store._get_full_path(outputs["H2"]).exists()
+    depot.pull(env_auth_id, complete=True, handlers=["H2"])
+    assert _get_outputs("H2") == [outputs["H2"]]
+    assert depot.object_store.read_bytes(outputs["H2"]) == b"H2"
+
+
+def test_growing_packs(env_auth_id: str, tmp_path: Path):
+    config = aswan.DepotConfig(packed_objects=True)
+    depot = AswanDepot("packs", tmp_path / "d1", config=config).setup(True)
+    puller = AswanDepot("packs", tmp_path / "d2", config=config).setup(True)
+    # an actor keeps appending to its segment between pushes
+    actor_store = config.get_object_store(depot.object_store_path)
+    names = []
+    for i in range(3):
+        names.append(actor_store.dump_bytes(f"obj-{i}".encode()))
+        depot.current.integrate_events([_cev(url=f"url{i}", output_file=names[-1])])
+        depot.save_current()
+        depot.current.purge()
+        depot.init_w_complete()
+        depot.push(env_auth_id)
+        puller.pull(env_auth_id, complete=True)
+        for j, name in enumerate(names):
+            assert puller.object_store.read_bytes(name) == f"obj-{j}".encode()
+    actor_store.close()
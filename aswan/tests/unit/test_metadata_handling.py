@@ -1,8 +1,18 @@
+import time
 from functools import partial
 
+from sqlalchemy import func
+
 from aswan.constants import Statuses
-from aswan.metadata_handling import add_urls, get_next_batch
-from aswan.models import CollEvent, SourceUrl
+from aswan.metadata_handling import (
+    add_urls,
+    get_grouped_surls,
+    get_next_batch,
+    integrate_events,
+    reset_surls,
+    start_lease,
+)
+from aswan.models import CollEvent, RegEvent, SourceUrl, partial_read
 
 get_surl = partial(
     SourceUrl, url="link-1", handler="A", current_status=Statuses.PROCESSED
@@ -36,6 +46,44 @@ def test_register(dbsession):
         assert dbsession.query(SourceUrl).count() == expected_count
 
 
+def test_integrate_events(dbsession):
+    urls = [f"u{i}" for i in range(2000)]
+    add_urls(dbsession, "A", urls)
+    dbsession.add(get_surl(url="u0", handler="B", current_status=Statuses.TODO))
+    dbsession.commit()
+
+    events = [
+        *[get_cev(url=url) for url in urls[:1500]],
+        get_cev(url="u1500", status=Statuses.PARSING_ERROR),
+        RegEvent(url="u1501", handler="A", overwrite=True),
+        RegEvent(url="u1502", handler="A"),
+        RegEvent(url="new", handler="A"),
+    ]
+    integrate_events(dbsession, events)
+
+    status_of = {
+        (s.handler, s.url): s.current_status for s in dbsession.query(SourceUrl)
+    }
+    assert len(status_of) == 502
+    assert status_of[("B", "u0")] == Statuses.TODO
+    assert status_of[("A", "u1500")] == Statuses.PARSING_ERROR
+    assert status_of[("A", "new")] == Statuses.TODO
+
+    dbsession.query(SourceUrl).update({"current_status": Statuses.PROCESSING})
+    dbsession.commit()
+    add_urls(dbsession, "A", ["u1501", "u1502"], overwrite=True)
+    add_urls(dbsession, "A", ["u1503"])
+    checked = SourceUrl.url.in_([f"u{i}" for i in range(1500, 1504)])
+    assert {
+        s.url: s.current_status for s in dbsession.query(SourceUrl).filter(checked)
+    } == {
+        "u1500": Statuses.PROCESSING,
+        "u1501": Statuses.TODO,
+        "u1502": Statuses.TODO,
+        "u1503": Statuses.PROCESSING,
+    }
+
+
 def test_batch(dbsession):
     dbsession.add(get_surl(current_status=Statuses.TODO))
     dbsession.add(get_surl(handler="B", current_status=Statuses.SESSION_BROKEN))
@@ -52,6 +100,71 @@ def test_batch(dbsession):
     assert len(get_next_batch(dbsession, 2)) == 2
 
 
+def test_frontier(dbsession):
+    add_urls(dbsession, "A", [f"a{i}" for i in range(1000)])
+    add_urls(dbsession, "A", ["a500", "a501"], priority=2)
+    add_urls(dbsession, "A", ["a400"], priority=1)
+    add_urls(dbsession, "A", ["a501"])
+    add_urls(dbsession, "B", ["b1", "b2"])
+    add_urls(dbsession, "C", ["c1"])
+    dbsession.query(SourceUrl).filter(SourceUrl.url == "b2").update(
+        {"current_status": Statuses.SESSION_BROKEN}
+    )
+    dbsession.commit()
+
+    batch = get_next_batch(dbsession, 6)
+    a_urls = [s.url for s in batch if s.handler == "A"]
+    assert (set(a_urls[:2]), a_urls[2]) == ({"a500", "a501"}, "a400")
+    assert {s.url for s in batch if s.handler != "A"} == {"b1", "b2", "c1"}
+    assert len(get_next_batch(dbsession, 4, to_processing=False)) == 4
+    assert get_next_batch(dbsession, 0) == []
+
+
+def test_leases(dbsession):
+    add_urls(dbsession, "A", ["a1", "a2", "a3"])
+    [dead] = get_next_batch(dbsession, 1, parser=lambda b: [s.url for s in b])
+    # queued urls wait without expiry
+    [queued] = get_next_batch(dbsession, 1, parser=lambda b: [s.url for s in b])
+    start_lease(dbsession, "A", dead, lease_seconds=-1, lease_owner="dead")
+
+    batch = get_next_batch(dbsession, 5, lease_owner="live")
+    assert sorted(s.url for s in batch) == sorted({"a1", "a2", "a3"} - {queued})
+    assert {(s.lease_owner, s.lease_expires) for s in batch} == {("live", None)}
+    assert get_next_batch(dbsession, 5) == []
+
+    leased = batch[0].url
+    start_lease(dbsession, "A", leased, lease_seconds=60, lease_owner="actor")
+    surl = dbsession.query(SourceUrl).filter(SourceUrl.url == leased).one()
+    assert surl.lease_owner == "actor"
+    assert surl.lease_expires > time.time()
+    integrate_events(dbsession, [get_cev(url=leased, status=Statuses.PARSING_ERROR)])
+    # a late lease does not take a url that is not processing
+    start_lease(dbsession, "A", leased, lease_seconds=60, lease_owner="late")
+    dbsession.refresh(surl)
+    assert (surl.lease_owner, surl.lease_expires) == (None, None)
+
+
+def test_surl_counts(dbsession):
+    add_urls(dbsession, "A", [f"a{i}" for i in range(20)])
+    add_urls(dbsession, "B", ["b1", "b2"])
+    get_next_batch(dbsession, 10)
+    integrate_events(
+        dbsession,
+        [
+            get_cev(url="a0"),
+            get_cev(url="a1", status=Statuses.CONNECTION_ERROR),
+            get_cev(url="b1", handler="B", status=Statuses.PARSING_ERROR),
+            RegEvent("a2", "A", overwrite=True),
+            RegEvent("c1", "C"),
+        ],
+    )
+    reset_surls(dbsession, [Statuses.PARSING_ERROR])
+
+    cols = [SourceUrl.current_status, SourceUrl.handler]
+    grouped = dbsession.query(*cols, func.count()).group_by(*cols).all()
+    assert sorted(get_grouped_surls(dbsession)) == sorted(grouped)
+
+
 def test_surl():
     surl = get_surl()
     assert surl.handler in surl.__repr__()
@@ -61,3 +174,26 @@ def test_cev(tmp_path):
     cev = get_cev()
     assert cev.status in cev.__repr__()
     cev.dump(tmp_path)
+
+
+def test_event_blobs():
+    events = [
+        get_cev(url="link-ü", output_file=""),
+        RegEvent("link-2", "B", True),
+        RegEvent("link-3", "B", priority=-2),
+    ]
+    for ev in events:
+        for binary in [False, True]:
+            name, blob = ev.to_record(binary)
+            assert blob.startswith(b"\x00") == binary
+            read_ev = partial_read(name, lambda: blob)
+            assert read_ev.url is None
+            assert read_ev.extend().to_record(binary) == (name, blob)
+    assert not hasattr(events[0], "__dict__")
+
+    # written before priorities
+    old_reg = partial_read(RegEvent("link-2", "B").to_record()[0], lambda: b"F\nl2")
+    assert (old_reg.extend().url, old_reg.priority) == ("l2", 0)
+    old_bin = b"\x00\x00\x02\x00\x00\x00l2"
+    old_reg = partial_read(RegEvent("link-2", "B").to_record()[0], lambda: old_bin)
+    assert (old_reg.extend().url, old_reg.priority) == ("l2", 0)
@@ -1,3 +1,4 @@
+import hashlib
 from random import choice, choices
 from string import ascii_letters
 
@@ -5,7 +6,7 @@ import pytest
 from atqo import parallel_map
 from bs4 import BeautifulSoup
 
-from aswan.object_store import ObjectStore
+from aswan.object_store import ObjectStore, StoredObject
 
 
 @pytest.fixture
@@ -68,3 +69,165 @@ def test_purge(tmp_obj_store: ObjectStore):
 def test_soup(tmp_obj_store: ObjectStore):
     s = BeautifulSoup("<html></html>", "html5lib")
     tmp_obj_store.dump(s)
+
+
+def test_packed_store(tmp_path):
+    store = ObjectStore(tmp_path, packed=True, segment_size=200)
+    objects = [{"A": i, "B": "x" * (i * 20)} for i in range(10)]
+    names = [store.dump(o) for o in objects]
+    assert names == [store.dump(o) for o in objects]
+    assert [*tmp_path.iterdir()] == [tmp_path / "packs"]
+    assert len([*(tmp_path / "packs").glob("*.pack")]) > 1
+    store.close()
+    other = ObjectStore(tmp_path)
+    for name, obj in zip(names, objects):
+        assert obj == store.read(name)
+        assert obj == other.read(name)
+    with pytest.raises(FileNotFoundError):
+        other.read_bytes("missing.blob")
+    store.purge()
+    assert not tmp_path.exists()
+
+
+def test_migrate_to_packs(tmp_obj_store: ObjectStore):
+    objects = [[i, "y"] for i in range(8)]
+    names = [tmp_obj_store.dump(o) for o in objects]
+    tmp_obj_store.packed = True
+    assert tmp_obj_store.migrate_to_packs() == len(objects)
+    assert [p.name for p in tmp_obj_store.root_path.iterdir()] == ["packs"]
+    assert objects == [*map(tmp_obj_store.read, names)]
+    assert objects == [*map(ObjectStore(tmp_obj_store.root_path).read, names)]
+
+
+@pytest.mark.parametrize("codec", ["zip", "deflate", "zstd", "brotli", "lz4", "none"])
+@pytest.mark.parametrize("packed", [True, False])
+def test_codecs(tmp_path, codec, packed):
+    old_store = ObjectStore(tmp_path)
+    old_name = old_store.dump(["old", 1])
+    store = ObjectStore(tmp_path, codec=codec, packed=packed)
+    name = store.dump({"new": 2})
+    assert old_store.read(name) == {"new": 2}
+    assert store.read(old_name) == ["old", 1]
+
+
+def test_dictionary(tmp_path):
+    store = ObjectStore(tmp_path, codec="zstd", packed=True)
+    pages = [
+        f"<html><div class='price'>{i}</div>{choice(ascii_letters) * 30}</html>"
+        for i in range(300)
+    ]
+    names = [*map(store.dump, pages)]
+    dict_id = store.train_dictionary("H", names, dict_size=2048)
+    assert dict_id.startswith("H-")
+    page = "<html><div class='price'>X</div></html>"
+    dname = store.dump(page, dict_key="H")
+    assert page == ObjectStore(tmp_path).read(dname)
+    assert store._get_dict_id("other") == ""
+
+
+def test_cache(tmp_path):
+    store = ObjectStore(tmp_path, cache_size=100)
+    names = [store.dump_bytes(bytes([i]) * 40) for i in range(3)]
+    assert [*map(store.read_bytes, names)] == [bytes([i]) * 40 for i in range(3)]
+    assert store._cache.size == 80
+    assert store._cache.get(names[0]) is None
+    store.read_bytes(names[1])
+    store.read_bytes(store.dump_bytes(b"x" * 30))
+    assert store._cache.get(names[2]) is None
+    assert store._cache.get(names[1]) is not None
+    store.read_bytes(store.dump_bytes(b"y" * 200))
+    assert store._cache.size == 70
+
+
+@pytest.mark.parametrize("processes", [True, False])
+def test_read_many(tmp_obj_store: ObjectStore, processes):
+    objects = [{"i": i} for i in range(30)]
+    names = [*map(tmp_obj_store.dump, objects)]
+    assert [*tmp_obj_store.read_many(names, 2, processes)] == objects
+
+
+def test_read_many_pickles_once(tmp_obj_store: ObjectStore, monkeypatch):
+    names = [tmp_obj_store.dump({"i": i}) for i in range(30)]
+    pickled = []
+    _getstate = ObjectStore.__getstate__
+
+    def _count_pickles(store):
+        pickled.append(store)
+        return _getstate(store)
+
+    monkeypatch.setattr(ObjectStore, "__getstate__", _count_pickles)
+    assert len([*tmp_obj_store.read_many(names, 2, True)]) == 30
+    # sent to each worker at most once, not with every name
+    assert len(pickled) <= 2
+
+
+def test_write_behind(tmp_path):
+    store = ObjectStore(tmp_path, write_behind=2)
+    written = []
+    names = []
+    for i in range(10):
+        names.append(store.dump({"i": i}))
+        assert store.read(names[-1]) == {"i": i}
+        store.when_written(written.append, i)
+    store.flush()
+    assert written == [*range(10)]
+    assert not store._pending
+    store.close()
+    assert [ObjectStore(tmp_path).read(n)["i"] for n in names] == written
+
+    store.when_written(int, "not an int")
+    with pytest.raises(ValueError):
+        store.flush()
+
+
+def test_hash_options(tmp_path):
+    legacy = ObjectStore(tmp_path, hash_fun=hashlib.sha3_512)
+    names = [legacy.dump("obj")]
+    for hash_name in ["sha3", "blake2b", "xxh3"]:
+        store = ObjectStore(tmp_path, hash_fun=hash_name, packed=len(names) > 1)
+        names.append(store.dump("obj"))
+    assert names[0] == names[1]
+    assert names[2].startswith("b2_") and len(names[2]) < 50
+    assert names[3].startswith("x3_")
+    for name in names:
+        assert legacy.read(name) == "obj"
+    assert legacy._get_full_path(names[2]).parent.name == names[2][3:5]
+
+
+@pytest.mark.parametrize("codec", ["zip", "zstd", "lz4", "none"])
+@pytest.mark.parametrize("packed", [True, False])
+def test_streams(tmp_path, codec, packed):
+    store = ObjectStore(tmp_path, codec=codec, packed=packed)
+    chunks = [choice(ascii_letters).encode() * 50_000 for _ in range(5)]
+    with store.open_write() as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    assert isinstance(writer.name, StoredObject)
+    assert writer.name == store.dump_bytes(b"".join(chunks))
+    assert store.dump(writer.name) == writer.name
+    with ObjectStore(tmp_path).open_read(writer.name) as fp:
+        assert fp.read(10) == chunks[0][:10]
+        assert fp.read() == b"".join(chunks)[10:]
+    assert not [*(tmp_path / "tmp").iterdir()]
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_deltas(tmp_path, packed):
+    store = ObjectStore(tmp_path, packed=packed, delta_chain_length=2)
+    page = "".join(choices(ascii_letters, k=20_000))
+    versions = [f"{page}<price>{i}</price>" for i in range(5)]
+    names = [store.dump(v, delta_key="H url") for v in versions]
+    assert [*map(ObjectStore(tmp_path).read, names)] == versions
+    assert store.get_bases(names) == {names[0], names[3]}
+    with store.open_read(names[1]) as fp:
+        assert fp.read().decode("utf-8") == versions[1]
+    raws = [store._open_raw(n) for n in names[:2]]
+    sizes = [len(fp.read(length)) for fp, length in raws]
+    [fp.close() for fp, _ in raws]
+    assert sizes[1] * 20 < sizes[0]
+
+    assert store.sweep({names[2]}) > 0
+    assert store.read(names[2]) == versions[2]
+    with pytest.raises(FileNotFoundError):
+        store.read(names[4])
+    assert store.read(store.dump(versions[4], delta_key="H url")) == versions[4]
@@ -1,6 +1,7 @@
 import pytest
 
 from aswan import Project
+from aswan.depot.event_writer import EventWriter
 from aswan.models import RegEvent
 from aswan.tests.godel_src.handlers import AuthedProxy
 from aswan.url_handler import BrowserHandler, RequestHandler
@@ -45,3 +46,52 @@ def test_commit_refuse(test_project2: Project):
     depot.current.next_batch(2)
     with pytest.raises(ValueError):
         test_project2.commit_current_run()
+
+
+def test_single_writer(test_project2: Project):
+    test_project2.depot.config.single_writer = True
+    test_project2.max_cpu_use = 2
+    test_project2.run(urls_to_register={CLH: list(map(str, range(30)))})
+    pcevs = test_project2.depot.get_handler_events(CLH, from_current=True)
+    assert sorted(pcev.url for pcev in pcevs) == sorted(map(str, range(30)))
+    assert not test_project2.depot.current.next_batch(30)
+
+
+def test_single_writer_failed_run(test_project2: Project, monkeypatch):
+    closed = []
+    _close = EventWriter.close
+    monkeypatch.setattr(EventWriter, "close", lambda w: closed.append(_close(w)))
+
+    def _fail():
+        raise RuntimeError("no batch")
+
+    monkeypatch.setattr(test_project2, "_get_next_batch", _fail)
+    test_project2.depot.config.single_writer = True
+    old_api = test_project2.distributed_api
+    with pytest.raises(RuntimeError):
+        test_project2.run(urls_to_register={CLH: ["1"]}, force_sync=True)
+    assert closed and (test_project2._event_writer is None)
+    assert test_project2.distributed_api == old_api
+
+
+def test_continue_legacy_db(test_project2: Project):
+    current = test_project2.depot.setup(init=True).current
+    with current.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE source_urls")
+        conn.exec_driver_sql("DROP TABLE surl_counts")
+        conn.exec_driver_sql(
+            "CREATE TABLE source_urls (cid INTEGER PRIMARY KEY, url VARCHAR,"
+            " handler VARCHAR, current_status VARCHAR, UNIQUE (url, handler))"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO source_urls VALUES"
+            " (1, '0', 'CLH', 'todo'), (2, '1', 'CLH', 'processing')"
+        )
+    assert current.setup().any_in_progress()
+
+    test_project2.register_handler(CLH)
+    test_project2.max_cpu_use = 2
+    test_project2.continue_run()
+    assert not current.any_in_progress()
+    assert not current.next_batch(5)
+    test_project2.commit_current_run()
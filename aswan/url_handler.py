@@ -51,7 +51,9 @@ class UrlHandlerBase:
         links: Iterable[str],
         handler_cls: Optional[Type["ANY_HANDLER_T"]] = None,
         overwrite: bool = False,
+        priority: int = 0,
     ):
+        """urls with a higher priority are collected sooner within a handler"""
         if handler_cls is None:
             handler_cls = type(self)
         self._registered_links += [
@@ -59,6 +61,7 @@ class UrlHandlerBase:
                 url=self.extend_link(link),
                 handler=handler_cls.__name__,
                 overwrite=overwrite,
+                priority=priority,
             )
             for link in links
         ]
@@ -128,6 +131,18 @@ class RequestHandler(UrlHandlerBase):
         return True
 
 
+class RequestStreamHandler(RequestHandler):
+    """response body is streamed into the object store, never held in memory
+
+    parse gets the name of the stored object
+    """
+
+    chunk_size: int = 2**16
+
+    def parse(self, obj_name: str):
+        return obj_name
+
+
 class BrowserHandler(UrlHandlerBase):
     headless: bool = False
     eager: bool = False
@@ -0,0 +1,63 @@
+"""dump throughput of the object store with the different hash functions
+
+python benchmarks/object_store_hashing.py [object count] [object size in kB]
+"""
+
+import sys
+import time
+from random import choices
+from string import ascii_letters
+from tempfile import TemporaryDirectory
+
+from aswan.object_store import ObjectStore
+from aswan.object_store.hashing import HASHES
+
+
+def bench(hash_name: str, objects: list[bytes], **store_kwargs):
+    with TemporaryDirectory() as tmp_dir:
+        store = ObjectStore(tmp_dir, hash_fun=hash_name, **store_kwargs)
+        start = time.perf_counter()
+        for obj in objects:
+            store.dump_bytes(obj)
+        store.close()
+        elapsed = time.perf_counter() - start
+        name_len = len(store.dump_bytes(b""))
+    return elapsed, name_len
+
+
+def hash_only(hash_name: str, objects: list[bytes]):
+    hash_fun = HASHES[hash_name][0]
+    start = time.perf_counter()
+    for obj in objects:
+        hash_fun(obj).hexdigest()
+    return time.perf_counter() - start
+
+
+def main(count: int = 2000, kb_size: int = 64):
+    # somewhat compressible, like html
+    words = ["".join(choices(ascii_letters, k=8)) for _ in range(512)]
+    objects = [
+        " ".join(choices(words, k=kb_size * 1024 // 9)).encode() for _ in range(count)
+    ]
+    mb_total = sum(map(len, objects)) / 2**20
+    print(f"{count} objects, {mb_total:.1f} MB")
+    print(
+        f"{'hash':>8} {'name len':>9} {'hash MB/s':>10} {'file MB/s':>10} "
+        f"{'packed MB/s':>12}"
+    )
+    for hash_name in HASHES.keys():
+        try:
+            hash_time = hash_only(hash_name, objects)
+        except ImportError:
+            print(f"{hash_name:>8} not installed")
+            continue
+        file_time, name_len = bench(hash_name, objects)
+        packed_time, _ = bench(hash_name, objects, packed=True, codec="zstd")
+        print(
+            f"{hash_name:>8} {name_len:>9} {mb_total / hash_time:>10.1f} "
+            f"{mb_total / file_time:>10.1f} {mb_total / packed_time:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))